@@ -1,7 +1,7 @@
-import sqlite3
+import db
 
 def main() -> None:
-    conn = sqlite3.connect('solus_bingo.db')
+    conn = db.connect_readonly()
     cursor = conn.cursor()
 
     cursor.execute('SELECT * FROM skilling where player_id=1 ')
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sys
+import db
+import numpy as np
+import pandas as pd
+
+BINGO_BOARD = os.getenv('BINGO_BOARD', 'bingo_board.json')
+BINGO_SHEET = 'Bingo Board'
+
+# A tile sums weight * (latest - baseline) over its metrics, per player or per team, and is complete at target.
+# metrics: {kind: [wom values]} with weight 1 each, or {kind: {wom value: weight}}.
+
+
+def load_board(path: str = BINGO_BOARD) -> tuple:
+    with open(path) as board_file:
+        board = json.load(board_file)
+    tiles = []
+    for tile in board['tiles']:
+        weights = {}
+        for kind, kind_metrics in tile['metrics'].items():
+            if isinstance(kind_metrics, list):
+                kind_metrics = {metric: 1 for metric in kind_metrics}
+            weights.update({(kind, metric): float(weight) for metric, weight in kind_metrics.items()})
+        tiles.append({
+            'id': tile['id'],
+            'name': tile.get('name', tile['id']),
+            'scope': tile.get('scope', 'player'),
+            'target': float(tile['target']),
+            'weights': weights,
+        })
+    board_hash = hashlib.sha1(json.dumps(board, sort_keys=True).encode()).hexdigest()
+    return tiles, board_hash
+
+
+def metric_ids(conn, tiles: list) -> dict:
+    # (kind, wom value) -> metric id, for the board metrics WOM has returned so far.
+    wanted = {key for tile in tiles for key in tile['weights']}
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, kind, wom_value FROM metrics')
+    return {(kind, wom_value): metric_id for metric_id, kind, wom_value in cursor.fetchall() if (kind, wom_value) in wanted}
+
+
+def changed_since(conn, watermark: str, ids: dict) -> pd.DataFrame:
+    # latest.created_date moves whenever ingest upserts a newer value.
+    placeholders = ', '.join('?' for _ in ids)
+    return pd.read_sql_query(f'''
+    SELECT l.player_id, p.team, m.kind, m.wom_value
+    FROM latest l
+    JOIN players p
+    ON l.player_id = p.id
+    JOIN metrics m
+    ON l.metric_id = m.id
+    WHERE l.created_date >= ? AND l.metric_id IN ({placeholders})
+    ''', conn, params=(watermark, *ids.values()))
+
+
+def load_gains(conn, ids: dict, teams: set = None, player_ids: set = None) -> pd.DataFrame:
+    where = f"AND l.metric_id IN ({', '.join('?' for _ in ids)})"
+    params = list(ids.values())
+    if teams is not None:
+        # Whole teams, so team tiles sum every member and not only the players that changed.
+        where += f" AND (p.team IN ({', '.join('?' for _ in teams)}) OR l.player_id IN ({', '.join('?' for _ in player_ids)}))"
+        params += [*teams, *player_ids]
+    return pd.read_sql_query(f'''
+    SELECT l.player_id, p.team, m.kind, m.wom_value, l.value - b.value AS gained
+    FROM latest l
+    JOIN baseline b
+    ON b.player_id = l.player_id AND b.metric_id = l.metric_id
+    JOIN players p
+    ON l.player_id = p.id
+    JOIN metrics m
+    ON l.metric_id = m.id
+    WHERE 1 = 1 {where}
+    ''', conn, params=params)
+
+
+def evaluate(gains: pd.DataFrame, tiles: list) -> tuple:
+    # One players x metrics gain matrix times one metrics x tiles weight matrix; team sums add up member rows.
+    player_codes, player_ids = pd.factorize(gains['player_id'])
+    metric_keys = list(zip(gains['kind'], gains['wom_value']))
+    metric_codes, metrics = pd.factorize(pd.Series(metric_keys, dtype=object))
+    metric_index = {key: index for index, key in enumerate(metrics)}
+
+    gained = np.zeros((len(player_ids), len(metrics)))
+    gained[player_codes, metric_codes] = gains['gained'].fillna(0).to_numpy(dtype=float)
+
+    weights = np.zeros((len(metrics), len(tiles)))
+    for tile_index, tile in enumerate(tiles):
+        for key, weight in tile['weights'].items():
+            if key in metric_index:
+                weights[metric_index[key], tile_index] = weight
+    targets = np.array([tile['target'] for tile in tiles])
+
+    player_values = gained @ weights
+
+    player_teams = gains.groupby('player_id', sort=False)['team'].first().reindex(player_ids)
+    team_codes, teams = pd.factorize(player_teams)
+    team_values = np.zeros((len(teams), len(tiles)))
+    np.add.at(team_values, team_codes[team_codes >= 0], player_values[team_codes >= 0])
+
+    player_df = tile_frame(player_values, targets, tiles, 'player', 'player_id', player_ids)
+    team_df = tile_frame(team_values, targets, tiles, 'team', 'team', teams)
+    return player_df, team_df
+
+
+def tile_frame(values: np.ndarray, targets: np.ndarray, tiles: list, scope: str, entity_column: str, entities) -> pd.DataFrame:
+    columns = [index for index, tile in enumerate(tiles) if tile['scope'] == scope]
+    values = values[:, columns]
+    progress = np.clip(values / targets[columns], 0, 1)
+    return pd.DataFrame({
+        'tile': np.tile([tiles[index]['id'] for index in columns], len(entities)),
+        entity_column: np.repeat(np.asarray(entities), len(columns)),
+        'value': values.ravel(),
+        'progress': (progress * 100).ravel(),
+        'complete': (progress >= 1).ravel().astype(int),
+    })
+
+
+def update(full: bool = False) -> int:
+    # Re-evaluates only the tiles whose metrics changed since the last run, for the players (and teams) that changed.
+    tiles, board_hash = load_board()
+    conn = db.connect()
+    cursor = conn.cursor()
+    ids = metric_ids(conn, tiles)
+
+    cursor.execute('SELECT MAX(created_date) FROM latest')
+    evaluated_through = cursor.fetchone()[0]
+    cursor.execute('SELECT evaluated_through FROM bingo_state WHERE board_hash = ?', (board_hash,))
+    state = cursor.fetchone()
+
+    if full or state is None or state[0] is None:
+        # A new or edited board starts over, so tiles it dropped don't linger.
+        cursor.execute('DELETE FROM bingo_player_tiles')
+        cursor.execute('DELETE FROM bingo_team_tiles')
+        cursor.execute('DELETE FROM bingo_state')
+        gains = load_gains(conn, ids) if ids else None
+    else:
+        changed = changed_since(conn, state[0], ids) if ids else None
+        if changed is None or changed.empty:
+            conn.close()
+            return 0
+        changed_keys = set(zip(changed['kind'], changed['wom_value']))
+        tiles = [tile for tile in tiles if changed_keys & tile['weights'].keys()]
+        ids = {key: metric_id for key, metric_id in ids.items() if any(key in tile['weights'] for tile in tiles)}
+        teams = set(changed['team'].dropna()) if any(tile['scope'] == 'team' for tile in tiles) else set()
+        gains = load_gains(conn, ids, teams, set(changed['player_id']))
+
+    evaluated = 0
+    if gains is not None and not gains.empty:
+        player_df, team_df = evaluate(gains, tiles)
+        cursor.executemany('''
+        INSERT INTO bingo_player_tiles (tile, player_id, value, progress, complete) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (tile, player_id) DO UPDATE SET
+            value = excluded.value, progress = excluded.progress, complete = excluded.complete, modified_date = CURRENT_TIMESTAMP
+        ''', player_df.itertuples(index=False, name=None))
+        cursor.executemany('''
+        INSERT INTO bingo_team_tiles (tile, team, value, progress, complete) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (tile, team) DO UPDATE SET
+            value = excluded.value, progress = excluded.progress, complete = excluded.complete, modified_date = CURRENT_TIMESTAMP
+        ''', team_df.itertuples(index=False, name=None))
+        evaluated = len(player_df) + len(team_df)
+
+    cursor.execute('''
+    INSERT INTO bingo_state (board_hash, evaluated_through) VALUES (?, ?)
+    ON CONFLICT (board_hash) DO UPDATE SET evaluated_through = excluded.evaluated_through, modified_date = CURRENT_TIMESTAMP
+    ''', (board_hash, evaluated_through))
+    conn.commit()
+    conn.close()
+    return evaluated
+
+
+def board_frame() -> pd.DataFrame:
+    # Every tile result in board order, players and teams alike, for the Bingo Board sheet.
+    tiles, _ = load_board()
+    conn = db.connect_readonly()
+    df = pd.read_sql_query('''
+    SELECT t.tile, 'player' AS scope, p.rsn, p.team, t.value, t.progress, t.complete
+    FROM bingo_player_tiles t
+    JOIN players p
+    ON t.player_id = p.id
+    UNION ALL
+    SELECT tile, 'team' AS scope, '' AS rsn, team, value, progress, complete
+    FROM bingo_team_tiles
+    ''', conn)
+    conn.close()
+
+    order = {tile['id']: index for index, tile in enumerate(tiles)}
+    names = {tile['id']: tile['name'] for tile in tiles}
+    targets = {tile['id']: tile['target'] for tile in tiles}
+    df = df[df['tile'].isin(order)]
+    df = df.assign(order=df['tile'].map(order)).sort_values(by=['order', 'team', 'rsn']).drop(columns='order')
+    df.insert(1, 'name', df['tile'].map(names))
+    df.insert(6, 'target', df['tile'].map(targets))
+    df['progress'] = df['progress'].round(2)
+    df['complete'] = df['complete'] == 1
+    return df.reset_index(drop=True)
+
+
+def main() -> None:
+    print(f'{update(full="--full" in sys.argv)} bingo tile results updated')
+
+
+if __name__ == '__main__':
+    main()
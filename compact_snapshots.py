@@ -0,0 +1,89 @@
+import os
+import time
+import db
+import make_migrations
+
+COMPACT_BUCKET_MINUTES = int(os.getenv('COMPACT_BUCKET_MINUTES', 60))
+COMPACT_CHUNK_SIZE = int(os.getenv('COMPACT_CHUNK_SIZE', 5000))
+
+# Rows are kept per partition; the archive index goes with them so a rebuild cannot restore what was compacted.
+PARTITIONS = {
+    'skilling': 'player_id, metric_id',
+    'bossing': 'player_id, metric_id',
+    'clues': 'player_id, metric_id',
+    'stats': 'player_id',
+    'wide_snapshots': 'player_id',
+    'snapshot_archive_index': 'player_id',
+    'snapshot_markers': 'player_id',
+}
+
+
+def compactable_rowids(cursor, table: str, partition: str) -> list:
+    # Keep the first and the two newest rows of each partition, so the newest delta is still the change since the
+    # previous fetch, and the last row of every bucket in between.
+    cursor.execute(f'''
+    SELECT rowid
+    FROM (
+        SELECT
+            rowid,
+            ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY created_date, rowid) AS from_first,
+            ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY created_date DESC, rowid DESC) AS from_last,
+            ROW_NUMBER() OVER (
+                PARTITION BY {partition}, CAST(strftime('%s', created_date) AS INTEGER) / ?
+                ORDER BY created_date DESC, rowid DESC
+            ) AS from_bucket_end
+        FROM {table}
+    )
+    WHERE from_first > 1 AND from_last > 2 AND from_bucket_end > 1
+    ''', (COMPACT_BUCKET_MINUTES * 60,))
+    return [rowid for rowid, in cursor.fetchall()]
+
+
+def database_size(cursor) -> int:
+    cursor.execute('PRAGMA page_count')
+    page_count = cursor.fetchone()[0]
+    cursor.execute('PRAGMA page_size')
+    return page_count * cursor.fetchone()[0]
+
+
+def main() -> None:
+    make_migrations.run()
+
+    conn = db.connect()
+    cursor = conn.cursor()
+    start = time.monotonic()
+    size_before = database_size(cursor)
+
+    # auto_vacuum only changes with a full VACUUM; after that each compaction can hand pages back incrementally.
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        print('switching database to incremental auto_vacuum, this runs a full VACUUM once')
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+
+    for table, partition in PARTITIONS.items():
+        rowids = compactable_rowids(cursor, table, partition)
+        for offset in range(0, len(rowids), COMPACT_CHUNK_SIZE):
+            chunk = rowids[offset:offset + COMPACT_CHUNK_SIZE]
+            with conn:
+                cursor.executemany(f'DELETE FROM {table} WHERE rowid = ?', [(rowid,) for rowid in chunk])
+        print(f'{table}: removed {len(rowids)} rows')
+
+    with conn:
+        cursor.execute('''
+        DELETE FROM snapshot_archive
+        WHERE hash NOT IN (SELECT hash FROM snapshot_archive_index)
+        ''')
+        print(f'snapshot_archive: removed {cursor.rowcount} payloads')
+
+    cursor.execute('PRAGMA incremental_vacuum')
+    cursor.fetchall()
+    size_after = database_size(cursor)
+
+    conn.close()
+
+    print(f'compacted in {time.monotonic() - start:.1f}s, {size_before / 2**20:.1f} MiB -> {size_after / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
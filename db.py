@@ -0,0 +1,30 @@
+import os
+import sqlite3
+
+DATABASE = os.getenv('SOLUS_DATABASE', 'solus_bingo.db')
+
+BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 30))
+CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+
+def _tune(conn: sqlite3.Connection) -> sqlite3.Connection:
+    # Negative cache_size is in KiB rather than pages.
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+def connect(**kwargs) -> sqlite3.Connection:
+    conn = sqlite3.connect(DATABASE, timeout=BUSY_TIMEOUT, **kwargs)
+    # WAL lets the publish scripts read while fetch_stats writes; it sticks to the file once set.
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return _tune(conn)
+
+
+def connect_readonly(**kwargs) -> sqlite3.Connection:
+    # Temp tables still work read-only, so the wide storage adapter can shadow tables here.
+    conn = sqlite3.connect(f'file:{DATABASE}?mode=ro', uri=True, timeout=BUSY_TIMEOUT, **kwargs)
+    return _tune(conn)
@@ -0,0 +1,120 @@
+import os
+import re
+import db
+import numpy as np
+import pandas as pd
+
+# sheet: read the rates from the Efficiency sheet once per run and refresh the efficiency_rates table,
+# local: use the efficiency_rates table as it is.
+EFFICIENCY_RATES_SOURCE = os.getenv('EFFICIENCY_RATES_SOURCE', 'sheet')
+EFFICIENCY_SHEET = 'Efficiency'
+# Headers already on the Efficiency sheet.
+EFFICIENCY_COLUMNS = {'rsn': 'RSN', 'team': 'Team', 'ehb': 'EHB', 'ehp': 'EHP', 'ehc': 'EHC'}
+
+# Each score sums a source's cumulative value_column divided by the metric's per hour rate.
+SCORES = {
+    'ehb': {'source': 'bossing', 'value_column': 'kills', 'rates_range': f'{EFFICIENCY_SHEET}!K3:L'},
+    'ehp': {'source': 'skilling', 'value_column': 'exp', 'rates_range': f'{EFFICIENCY_SHEET}!N3:O'},
+    'ehc': {'source': 'clues', 'value_column': 'clue_completions', 'rates_range': f'{EFFICIENCY_SHEET}!H3:I'},
+}
+
+# The Efficiency sheet names a few metrics differently from WOM.
+ALIASES = {
+    'defense': 'defence',
+    'chambersofxericcm': 'chambersofxericchallengemode',
+    'theatreofbloodhm': 'theatreofbloodhardmode',
+    'tombsofamascutexpertmode': 'tombsofamascutexpert',
+}
+
+
+def metric_key(name: str) -> str:
+    # "TzTok-Jad", "Kree'Arra" and "Easy" match tztok_jad, kreearra and clue_scrolls_easy.
+    key = re.sub('[^a-z0-9]', '', str(name).lower()).removeprefix('cluescrolls')
+    return ALIASES.get(key, key)
+
+
+def read_sheet_rates(session, conn) -> dict:
+    # One values.batchGet for all three rate tables, matched to the metrics table by name.
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, kind, wom_value FROM metrics')
+    metric_ids = {(kind, metric_key(wom_value)): metric_id for metric_id, kind, wom_value in cursor.fetchall()}
+
+    rates = {}
+    unmatched = []
+    for spec, rows in zip(SCORES.values(), session.read([spec['rates_range'] for spec in SCORES.values()])):
+        for row in rows:
+            if len(row) < 2 or not isinstance(row[1], (int, float)):
+                continue
+            metric_id = metric_ids.get((spec['source'], metric_key(row[0])))
+            if metric_id is None:
+                unmatched.append(row[0])
+            else:
+                rates[metric_id] = float(row[1])
+    if unmatched:
+        print(f'no metric for Efficiency rates: {", ".join(unmatched)}')
+    return rates
+
+
+def save_rates(conn, rates: dict) -> None:
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM efficiency_rates')
+    cursor.executemany('INSERT INTO efficiency_rates (metric_id, per_hour) VALUES (?, ?)', rates.items())
+
+
+def load_rates(conn) -> pd.DataFrame:
+    return pd.read_sql_query('''
+    SELECT m.kind, m.wom_value, r.per_hour
+    FROM efficiency_rates r
+    JOIN metrics m
+    ON r.metric_id = m.id
+    ''', conn)
+
+
+def compute_scores(sources: dict, rates: pd.DataFrame) -> pd.DataFrame:
+    # players x metrics cumulative matrix times a per metric 1 / rate vector, one product per score.
+    scores = []
+    for score, spec in SCORES.items():
+        df = sources[spec['source']]
+        matrix = df.pivot(index=['rsn', 'team'], columns='wom_value', values=f"cumulative_{spec['value_column']}")
+
+        kind_rates = rates[rates['kind'] == spec['source']].set_index('wom_value')['per_hour']
+        excluded = set(df.loc[df['excluded_from_efficiency'] == 1, 'wom_value'])
+        per_hour = np.where(matrix.columns.isin(excluded), 0, kind_rates.reindex(matrix.columns).fillna(0))
+
+        missing = [metric for metric, rate in zip(matrix.columns, per_hour) if rate <= 0 and metric not in excluded]
+        if missing:
+            print(f'no {score} rate for: {", ".join(missing)}')
+
+        weights = np.divide(1, per_hour, out=np.zeros_like(per_hour), where=per_hour > 0)
+        scores.append(pd.Series(matrix.fillna(0).to_numpy(dtype=float) @ weights, index=matrix.index, name=score))
+
+    scores_df = pd.concat(scores, axis=1).fillna(0).reset_index()
+    return scores_df.sort_values(by=['team', 'rsn'], ignore_index=True)
+
+
+def save_scores(conn, scores_df: pd.DataFrame) -> None:
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM player_efficiency')
+    cursor.executemany('''
+    INSERT INTO player_efficiency (player_id, ehb, ehp, ehc)
+    SELECT id, ?, ?, ? FROM players WHERE rsn = ?
+    ''', scores_df[['ehb', 'ehp', 'ehc', 'rsn']].itertuples(index=False, name=None))
+
+
+def refresh_rates(session) -> None:
+    if EFFICIENCY_RATES_SOURCE != 'sheet':
+        return
+    conn = db.connect()
+    save_rates(conn, read_sheet_rates(session, conn))
+    conn.commit()
+    conn.close()
+
+
+def update(sources: dict) -> pd.DataFrame:
+    # Rates and scores are kept in the database too, so other scripts don't need the sheet.
+    conn = db.connect()
+    scores_df = compute_scores(sources, load_rates(conn))
+    save_scores(conn, scores_df)
+    conn.commit()
+    conn.close()
+    return scores_df
@@ -1,24 +1,24 @@
 import wom
 import asyncio
 import make_migrations
-import sqlite3
+import db
 import os
 
+COMPETITION_ID = int(os.getenv('WOM_COMPETITION_ID', 49158))
+
 async def main() -> None:
     make_migrations.run()
 
     WOM_KEY = os.getenv('WOM_API_KEY')
     WOM_AGENT = os.getenv('USER_AGENT')
-    client = wom.Client(WOM_KEY, user_agent=WOM_AGENT)
+    WOM_BASE_URL = os.getenv('WOM_API_BASE_URL')
+    client = wom.Client(WOM_KEY, user_agent=WOM_AGENT, api_base_url=WOM_BASE_URL)
     await client.start()
 
-    conn = sqlite3.connect('solus_bingo.db')
+    conn = db.connect()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT * FROM players')
-    existing_players = {row[1] for row in cursor.fetchall()}
-
-    result = await client.competitions.get_details(id=49158)
+    result = await client.competitions.get_details(id=COMPETITION_ID)
 
     if result.is_ok:
         unwrapped_result = result.unwrap()
@@ -32,13 +32,11 @@ async def main() -> None:
         team = participant['participation']['data']['team_name']
         rsn = player['display_name']
         build = player['build'].name
-        if rsn not in existing_players:
-            cursor.execute('''
-            INSERT INTO players (rsn, team, build)
-            VALUES (?, ?, ?)
-            ''', (rsn, team, build))
-
-            existing_players.add(rsn)
+        cursor.execute('''
+        INSERT INTO players (rsn, team, build)
+        VALUES (?, ?, ?)
+        ON CONFLICT (rsn) DO NOTHING
+        ''', (rsn, team, build))
 
     conn.commit()
 
@@ -1,106 +1,258 @@
 import wom
 import asyncio
+import datetime
+import random
 import time
-import sqlite3
+import concurrent.futures
 import os
+import db
+import make_migrations
+import job_queue
+from ingest_pipeline import PipelineStats, mark_failed, write_stage, writer_executor
+from fetch_roster import COMPETITION_ID
+from rate_limiter import TokenBucket
+from snapshot_writer import SnapshotWriter
 
-async def main() -> None:
-    WOM_KEY = os.getenv('WOM_API_KEY')
-    WOM_AGENT = os.getenv('USER_AGENT')
-    client = wom.Client(WOM_KEY, user_agent=WOM_AGENT)
-    await client.start()
+# WOM allows 100 requests a minute with an API key and 20 without one.
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 5))
+WOM_RATE_LIMIT = float(os.getenv('WOM_RATE_LIMIT', 100 if os.getenv('WOM_API_KEY') else 20))
+WOM_RATE_BURST = int(os.getenv('WOM_RATE_BURST', 5))
+MAX_RETRIES = int(os.getenv('FETCH_MAX_RETRIES', 5))
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 50))
+FETCH_MAX_ATTEMPTS = int(os.getenv('FETCH_MAX_ATTEMPTS', 3))
+FETCH_QUEUE_DEPTH = int(os.getenv('FETCH_QUEUE_DEPTH', 2 * FETCH_BATCH_SIZE))
 
-    conn = sqlite3.connect('solus_bingo.db')
-    cursor = conn.cursor()
+# Competition mode needs the competition's verification code to trigger its update.
+WOM_VERIFICATION_CODE = os.getenv('WOM_VERIFICATION_CODE')
+FETCH_MODE = os.getenv('FETCH_MODE', 'competition' if WOM_VERIFICATION_CODE else 'players')
+COMPETITION_WAIT = float(os.getenv('COMPETITION_WAIT', 300))
+COMPETITION_POLL = float(os.getenv('COMPETITION_POLL', 30))
+STALE_AFTER = datetime.timedelta(minutes=float(os.getenv('STALE_AFTER_MINUTES', 60)))
 
-    cursor.execute('SELECT * FROM players')
-    players = list(row[1] for row in cursor.fetchall())
-    cursor.execute('SELECT * FROM players')
-    player_dict = {row[1]: row[0] for row in cursor.fetchall()}
 
-    for rsn in players:
-        result = await client.players.update_player(username=rsn)
+async def call_with_backoff(limiter: TokenBucket, request, **kwargs):
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.acquire()
+        result = await request(**kwargs)
         if result.is_ok:
-            pass
-        else:
-            print(result.unwrap_err)
+            return result
+
+        error = result.unwrap_err()
+        if getattr(error, 'status', None) != 429 or attempt == MAX_RETRIES:
+            return result
+
+        # wom.py doesn't hand back response headers, so Retry-After is approximated
+        # with an exponential backoff bounded by WOM's one minute window.
+        delay = min(60, 2 ** attempt * 60 / WOM_RATE_LIMIT) + random.uniform(0, 1)
+        print(f'rate limited, backing off {delay:.1f}s')
+        limiter.pause(delay)
+
+    return result
 
-        result = await client.players.get_details(username=rsn)
-        if result.is_ok:
-            unwrapped_result = result.unwrap()
-        else:
-            unwrapped_result = None
-            print(result.unwrap_err)
 
-        player_detail = unwrapped_result.to_dict()
+async def fetch_player(client: wom.Client, limiter: TokenBucket, rsn: str):
+    # update_player answers with the refreshed player details, so get_details is
+    # only needed when the update itself was rejected.
+    result = await call_with_backoff(limiter, client.players.update_player, username=rsn)
+    if result.is_ok:
+        return result.unwrap().to_dict(), None
+    print(rsn, result.unwrap_err())
 
-        player_id = player_dict[rsn]
-        snapshot_date = player_detail['latest_snapshot']['created_at']
+    return await fetch_details(client, limiter, rsn)
 
-        for skill in player_detail['latest_snapshot']['data']['skills'].values():
-            metric = skill['metric']
-            skill_name = metric.name
-            exp = skill['experience']
-            ehp = skill['ehp']
-            rank = skill['rank']
 
-            cursor.execute('''
-            INSERT INTO skilling (player_id, skill_name, exp, ehp, rank, snapshot_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (player_id, skill_name, exp, ehp, rank, snapshot_date))
+async def fetch_details(client: wom.Client, limiter: TokenBucket, rsn: str):
+    result = await call_with_backoff(limiter, client.players.get_details, username=rsn)
+    if result.is_ok:
+        return result.unwrap().to_dict(), None
+    print(rsn, result.unwrap_err())
 
-        conn.commit()
+    return None, str(result.unwrap_err())
 
-        for boss in player_detail['latest_snapshot']['data']['bosses'].values():
-            metric = boss['metric']
-            boss_name = metric.value.replace('_', ' ').title()
-            kills = boss['kills']
-            ehb = boss['ehb']
-            rank = boss['rank']
 
-            cursor.execute('''
-            INSERT INTO bossing (player_id, boss_name, kills, ehb, rank, snapshot_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (player_id, boss_name, kills, ehb, rank, snapshot_date))
+FETCHERS = {
+    'update': fetch_player,
+    'details': fetch_details,
+}
 
-        conn.commit()
 
-        for activity in player_detail['latest_snapshot']['data']['activities'].values():
-            metric = activity['metric']
-            activity_name = metric.value.replace('_', ' ').title()
-            if 'Clue' in activity_name:
-                clue_completions = activity['score']
-                cursor.execute('''
-                INSERT INTO clues (player_id, clue_type, clue_completions, rank, snapshot_date)
-                VALUES (?, ?, ?, ?, ?)
-                ''', (player_id, activity_name, clue_completions, rank, snapshot_date))
-            if 'Guardian' in activity_name:
-                ehb = 0.0
-                kills = activity['score']
-                rank = activity['rank']
-                cursor.execute('''
-                INSERT INTO bossing (player_id, boss_name, kills, ehb, rank, snapshot_date)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''', (player_id, activity_name, kills, ehb, rank, snapshot_date))
+def parse_timestamp(value) -> datetime.datetime:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
 
-        conn.commit()
 
-        ehb = player_detail['player']['ehb']
-        ehp = player_detail['player']['ehp']
+async def get_participants(client: wom.Client, limiter: TokenBucket):
+    result = await call_with_backoff(limiter, client.competitions.get_details, id=COMPETITION_ID)
+    if result.is_err:
+        print(result.unwrap_err())
+        return None
 
-        cursor.execute('''
-        INSERT INTO stats (player_id, ehb, ehp, snapshot_date)
-        VALUES (?, ?, ?, ?)
-        ''', (player_id, ehb, ehp, snapshot_date))
+    participations = result.unwrap().to_dict()['participations']
+    return {
+        participant['participation']['player']['display_name']: participant['participation']['player']
+        for participant in participations
+    }
 
-        conn.commit()
 
-        time.sleep(3)
+async def plan_competition_refresh(client: wom.Client, limiter: TokenBucket, player_dict: dict, last_seen: dict):
+    result = await call_with_backoff(
+        limiter,
+        client.competitions.update_outdated_participants,
+        id=COMPETITION_ID,
+        verification_code=WOM_VERIFICATION_CODE,
+    )
+    if result.is_err:
+        print(result.unwrap_err())
+        return None
+    print(result.unwrap())
 
+    # WOM queues the participant updates, so poll until the roster is fresh or the wait runs out.
+    deadline = time.monotonic() + COMPETITION_WAIT
+    while True:
+        participants = await get_participants(client, limiter)
+        if participants is None:
+            return None
 
-    await client.close()
+        stale_before = datetime.datetime.now(datetime.timezone.utc) - STALE_AFTER
+        stragglers = {
+            rsn for rsn in player_dict
+            if rsn not in participants
+            or participants[rsn]['updated_at'] is None
+            or parse_timestamp(participants[rsn]['updated_at']) < stale_before
+        }
+        if not stragglers or time.monotonic() + COMPETITION_POLL > deadline:
+            break
+        print(f'waiting on {len(stragglers)} participant updates')
+        await asyncio.sleep(COMPETITION_POLL)
+
+    # Fresh participants only need a details call when their stats changed since the stored snapshot.
+    changed = []
+    for rsn in player_dict:
+        if rsn in stragglers:
+            continue
+        last_changed_at = participants[rsn]['last_changed_at']
+        stored = last_seen.get(player_dict[rsn])
+        if stored is None or (last_changed_at is not None and parse_timestamp(last_changed_at) > parse_timestamp(stored)):
+            changed.append(rsn)
+
+    print(f'{len(changed)} participants changed, {len(stragglers)} stragglers to update individually')
+    return [(rsn, 'details') for rsn in changed] + [(rsn, 'update') for rsn in stragglers]
+
+
+async def worker(client: wom.Client, limiter: TokenBucket, queue: asyncio.Queue, results: asyncio.Queue,
+                 writer: SnapshotWriter, executor: concurrent.futures.ThreadPoolExecutor, run_id: int,
+                 player_names: dict, stats: PipelineStats, failed: dict) -> None:
+    while True:
+        try:
+            player_id, mode = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        rsn = player_names[player_id]
+        started = time.monotonic()
+        try:
+            player_detail, error = await FETCHERS[mode](client, limiter, rsn)
+        except Exception as exc:
+            player_detail, error = None, repr(exc)
+        stats.fetch.busy += time.monotonic() - started
+
+        if player_detail is not None:
+            stats.fetch.players += 1
+            waited = time.monotonic()
+            await results.put((player_id, player_detail))
+            stats.fetch.waiting += time.monotonic() - waited
+        else:
+            attempts = await mark_failed(executor, writer, run_id, player_id, error)
+            if attempts < FETCH_MAX_ATTEMPTS:
+                # Back of the queue, so a failing player never holds up the rest.
+                queue.put_nowait((player_id, mode))
+            else:
+                failed[rsn] = error
+
+
+async def main() -> None:
+    WOM_KEY = os.getenv('WOM_API_KEY')
+    WOM_AGENT = os.getenv('USER_AGENT')
+    WOM_BASE_URL = os.getenv('WOM_API_BASE_URL')
+
+    make_migrations.run()
+
+    conn = db.connect()
+    # The writer's connection is only ever used from the pipeline's writer thread.
+    writer_conn = db.connect(check_same_thread=False)
+    client = wom.Client(WOM_KEY, user_agent=WOM_AGENT, api_base_url=WOM_BASE_URL)
+
+    try:
+        await client.start()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM players')
+        player_dict = {row[1]: row[0] for row in cursor.fetchall()}
+        player_names = {player_id: rsn for rsn, player_id in player_dict.items()}
+
+        limiter = TokenBucket(WOM_RATE_LIMIT, WOM_RATE_BURST)
+        writer = SnapshotWriter(writer_conn, FETCH_BATCH_SIZE)
+        start = time.monotonic()
+
+        run_id = job_queue.resume_run(conn)
+        if run_id is not None:
+            print(f'resuming fetch run {run_id}')
+        else:
+            jobs = None
+            if FETCH_MODE == 'competition':
+                jobs = await plan_competition_refresh(client, limiter, player_dict, writer.last_seen)
+            if jobs is None:
+                jobs = [(rsn, 'update') for rsn in player_dict]
+            run_id = job_queue.create_run(conn, [(player_dict[rsn], mode) for rsn, mode in jobs])
+
+        writer.on_flush = lambda flush_cursor, player_ids: job_queue.mark_done(flush_cursor, run_id, player_ids)
+
+        queue = asyncio.Queue()
+        for job in job_queue.pending_jobs(conn, run_id, FETCH_MAX_ATTEMPTS):
+            queue.put_nowait(job)
+        queued = queue.qsize()
+
+        results = asyncio.Queue(maxsize=FETCH_QUEUE_DEPTH)
+        stats = PipelineStats()
+        failed = {}
+        write_failures = {}
+
+        # Snapshot batches and failed job marks share the writer's thread and connection.
+        with writer_executor() as executor:
+            writing = asyncio.create_task(write_stage(results, writer, run_id, stats, write_failures, executor))
+            fetching = asyncio.gather(*(
+                worker(client, limiter, queue, results, writer, executor, run_id, player_names, stats, failed)
+                for _ in range(FETCH_CONCURRENCY)
+            ))
+            await asyncio.wait([fetching, writing], return_when=asyncio.FIRST_COMPLETED)
+            if writing.done():
+                # The writer only stops early on an error; don't leave fetchers blocked on a full queue.
+                fetching.cancel()
+                await asyncio.gather(fetching, return_exceptions=True)
+                writing.result()
+            await results.put(None)
+            await writing
+
+        for player_id, error in write_failures.items():
+            failed[player_names[player_id]] = error
+        states = job_queue.finish_run(conn, run_id)
+        elapsed = time.monotonic() - start
+
+        print(f'refreshed {queued - len(failed)} of {len(player_dict)} players in {elapsed:.1f}s')
+        print(f'{writer.skipped} players had no new snapshot')
+        print(f'run {run_id} jobs: {states}')
+        stats.report(writer)
+        for rsn, error in failed.items():
+            print(f'failed: {rsn}: {error}')
+    finally:
+        # Also on the error path; a run that raised is left running, so the next fetch resumes it.
+        await client.close()
+        writer_conn.close()
+        conn.close()
 
 
 if __name__ == '__main__':
     asyncio.run(main())
-
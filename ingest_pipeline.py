@@ -0,0 +1,88 @@
+import asyncio
+import concurrent.futures
+import time
+import job_queue
+from snapshot_writer import SnapshotWriter
+
+
+class StageStats:
+    def __init__(self) -> None:
+        self.players = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+
+
+class PipelineStats:
+    def __init__(self) -> None:
+        self.fetch = StageStats()
+        self.write = StageStats()
+        self.start = time.monotonic()
+
+    def report(self, writer: SnapshotWriter) -> None:
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        fetch, write = self.fetch, self.write
+
+        print(f'fetch: {fetch.players} players, {fetch.players / elapsed:.2f}/s, '
+              f'{fetch.busy / max(fetch.players, 1):.2f}s per player, {fetch.waiting:.1f}s blocked on a full queue')
+        print(f'write: {write.players} players, {writer.rows_written} rows, '
+              f'{write.players / max(write.busy, 1e-9):.1f} players/s while busy, '
+              f'busy {write.busy / elapsed:.0%} of the run, {write.waiting:.1f}s waiting on fetches')
+
+        # A writer that is busy nearly all the time is what keeps the fetchers blocked.
+        bound = 'disk' if write.busy / elapsed > 0.8 else 'network'
+        print(f'ingest is {bound} bound')
+
+
+def write_batch(writer: SnapshotWriter, run_id: int, batch: list) -> dict:
+    failures = {}
+    for player_id, player_detail in batch:
+        try:
+            writer.add(player_id, player_detail)
+        except Exception as exc:
+            failures[player_id] = repr(exc)
+    writer.flush()
+
+    for player_id, error in failures.items():
+        job_queue.mark_failed(writer.conn, run_id, player_id, error)
+    return failures
+
+
+def writer_executor() -> concurrent.futures.ThreadPoolExecutor:
+    # One thread owns the writer's connection, so SQLite work never stalls the event loop.
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot-writer')
+
+
+async def mark_failed(executor: concurrent.futures.ThreadPoolExecutor, writer: SnapshotWriter, run_id: int,
+                      player_id: int, error: str) -> int:
+    # Queued behind any batch the writer thread is committing, instead of waiting on its lock in the event loop.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, job_queue.mark_failed, writer.conn, run_id, player_id, error)
+
+
+async def write_stage(results: asyncio.Queue, writer: SnapshotWriter, run_id: int,
+                      stats: PipelineStats, failures: dict, executor: concurrent.futures.ThreadPoolExecutor) -> None:
+    loop = asyncio.get_running_loop()
+    finished = False
+    while not finished:
+        waited = time.monotonic()
+        item = await results.get()
+        stats.write.waiting += time.monotonic() - waited
+
+        batch = []
+        while True:
+            if item is None:
+                finished = True
+                break
+            batch.append(item)
+            if len(batch) >= writer.batch_size:
+                break
+            try:
+                item = results.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+
+        if batch:
+            started = time.monotonic()
+            failures.update(await loop.run_in_executor(executor, write_batch, writer, run_id, batch))
+            stats.write.busy += time.monotonic() - started
+            stats.write.players += len(batch)
@@ -0,0 +1,75 @@
+import sqlite3
+
+
+def resume_run(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM fetch_runs WHERE status = 'running' ORDER BY id DESC LIMIT 1")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def run_progress(conn: sqlite3.Connection) -> float:
+    # Share of the running fetch run's jobs already written; 0 until a run has been created.
+    run_id = resume_run(conn)
+    if run_id is None:
+        return 0.0
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), SUM(state = 'done') FROM fetch_jobs WHERE run_id = ?", (run_id,))
+    total, done = cursor.fetchone()
+    return (done or 0) / total if total else 0.0
+
+
+def create_run(conn: sqlite3.Connection, jobs: list) -> int:
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO fetch_runs (status) VALUES ('running')")
+        run_id = cursor.lastrowid
+        cursor.executemany('''
+        INSERT INTO fetch_jobs (run_id, player_id, mode)
+        VALUES (?, ?, ?)
+        ''', [(run_id, player_id, mode) for player_id, mode in jobs])
+    return run_id
+
+
+def pending_jobs(conn: sqlite3.Connection, run_id: int, max_attempts: int) -> list:
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT player_id, mode
+    FROM fetch_jobs
+    WHERE run_id = ?
+    AND (state = 'pending' OR (state = 'failed' AND attempts < ?))
+    ORDER BY attempts, player_id
+    ''', (run_id, max_attempts))
+    return cursor.fetchall()
+
+
+def mark_done(cursor: sqlite3.Cursor, run_id: int, player_ids: list) -> None:
+    cursor.executemany('''
+    UPDATE fetch_jobs
+    SET state = 'done', error = NULL, modified_date = CURRENT_TIMESTAMP
+    WHERE run_id = ? AND player_id = ?
+    ''', [(run_id, player_id) for player_id in player_ids])
+
+
+def mark_failed(conn: sqlite3.Connection, run_id: int, player_id: int, error: str) -> int:
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        UPDATE fetch_jobs
+        SET state = 'failed', error = ?, attempts = attempts + 1, modified_date = CURRENT_TIMESTAMP
+        WHERE run_id = ? AND player_id = ?
+        ''', (error, run_id, player_id))
+        cursor.execute('SELECT attempts FROM fetch_jobs WHERE run_id = ? AND player_id = ?', (run_id, player_id))
+        return cursor.fetchone()[0]
+
+
+def finish_run(conn: sqlite3.Connection, run_id: int) -> dict:
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        UPDATE fetch_runs
+        SET status = 'complete', modified_date = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (run_id,))
+        cursor.execute('SELECT state, COUNT(*) FROM fetch_jobs WHERE run_id = ? GROUP BY state', (run_id,))
+        return dict(cursor.fetchall())
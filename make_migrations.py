@@ -1,10 +1,42 @@
+import json
 import sqlite3
+import db
 
 def run() -> None:
-    conn = sqlite3.connect('solus_bingo.db')
+    conn = db.connect()
 
     cursor = conn.cursor()
 
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    current_version = cursor.fetchone()[0]
+
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current_version:
+            continue
+
+        # Each step commits with its version row, so a failed step is retried on the next run.
+        cursor.execute('BEGIN')
+        try:
+            migration(cursor)
+            cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, migration.__name__))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f'applied migration {version}: {migration.__name__}')
+
+    conn.close()
+
+
+def create_base_tables(cursor: sqlite3.Cursor) -> None:
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS players (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -70,5 +102,382 @@ def run() -> None:
     )
     ''')
 
-    conn.commit()
-    conn.close()
+
+def track_player_snapshots(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS player_snapshots (
+        player_id INTEGER PRIMARY KEY,
+        snapshot_date TIMESTAMP,
+        modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+    ''')
+
+    create_unique_index(cursor, 'ux_skilling_snapshot', 'skilling', ['player_id', 'skill_name', 'snapshot_date'])
+    create_unique_index(cursor, 'ux_bossing_snapshot', 'bossing', ['player_id', 'boss_name', 'snapshot_date'])
+    create_unique_index(cursor, 'ux_clues_snapshot', 'clues', ['player_id', 'clue_type', 'snapshot_date'])
+    create_unique_index(cursor, 'ux_stats_snapshot', 'stats', ['player_id', 'snapshot_date'])
+
+    cursor.execute('''
+    INSERT OR IGNORE INTO player_snapshots (player_id, snapshot_date)
+    SELECT player_id, MAX(snapshot_date)
+    FROM stats
+    GROUP BY player_id
+    ''')
+
+
+def add_fetch_jobs(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS fetch_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL DEFAULT 'running',
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS fetch_jobs (
+        run_id INTEGER NOT NULL,
+        player_id INTEGER NOT NULL,
+        mode TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (run_id, player_id),
+        FOREIGN KEY (run_id) REFERENCES fetch_runs(id),
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+    ''')
+
+
+def add_snapshot_archive(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS snapshot_archive (
+        hash TEXT PRIMARY KEY,
+        payload BLOB NOT NULL,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS snapshot_archive_index (
+        player_id INTEGER NOT NULL,
+        snapshot_date TIMESTAMP NOT NULL,
+        hash TEXT NOT NULL,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (player_id, snapshot_date),
+        FOREIGN KEY (player_id) REFERENCES players(id),
+        FOREIGN KEY (hash) REFERENCES snapshot_archive(hash)
+    )
+    ''')
+
+
+def add_report_indexes(cursor: sqlite3.Cursor) -> None:
+    # Match the publish_* joins on player_id and their (rsn, metric, created_date) ordering.
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_players_team_rsn ON players (team, rsn)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_skilling_report ON skilling (player_id, skill_name, created_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_bossing_report ON bossing (player_id, boss_name, created_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_clues_report ON clues (player_id, clue_type, created_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_stats_report ON stats (player_id, created_date)')
+
+
+def unique_player_rsn(cursor: sqlite3.Cursor) -> None:
+    # Fold any duplicate players into the oldest row before making rsn unique.
+    cursor.execute('''
+    SELECT p.id, k.keep_id
+    FROM players p
+    JOIN (SELECT rsn, MIN(id) AS keep_id FROM players GROUP BY rsn) k
+    ON p.rsn = k.rsn AND p.id != k.keep_id
+    ''')
+    duplicates = cursor.fetchall()
+    for table in ['stats', 'skilling', 'bossing', 'clues', 'player_snapshots', 'fetch_jobs', 'snapshot_archive_index']:
+        cursor.executemany(f'UPDATE OR IGNORE {table} SET player_id = ? WHERE player_id = ?',
+                           [(keep_id, player_id) for player_id, keep_id in duplicates])
+        cursor.executemany(f'DELETE FROM {table} WHERE player_id = ?', [(player_id,) for player_id, _ in duplicates])
+    cursor.executemany('DELETE FROM players WHERE id = ?', [(player_id,) for player_id, _ in duplicates])
+
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_players_rsn ON players (rsn)')
+
+
+def add_wide_snapshots(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS wide_layouts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        layout TEXT NOT NULL UNIQUE,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS wide_snapshots (
+        player_id INTEGER NOT NULL,
+        snapshot_date TIMESTAMP NOT NULL,
+        layout_id INTEGER NOT NULL,
+        skills BLOB,
+        bosses BLOB,
+        clues BLOB,
+        ehb FLOAT,
+        ehp FLOAT,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (player_id, snapshot_date),
+        FOREIGN KEY (player_id) REFERENCES players(id),
+        FOREIGN KEY (layout_id) REFERENCES wide_layouts(id)
+    )
+    ''')
+
+
+def intern_metrics(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        wom_value TEXT NOT NULL,
+        display_name TEXT NOT NULL,
+        excluded_from_efficiency INTEGER NOT NULL DEFAULT 0,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (kind, wom_value)
+    )
+    ''')
+
+    fact_tables = {
+        'skilling': ('skill_name', 'exp INTEGER, ehp FLOAT, rank INTEGER', 'exp, ehp, rank'),
+        'bossing': ('boss_name', 'kills INTEGER, ehb FLOAT, rank INTEGER', 'kills, ehb, rank'),
+        'clues': ('clue_type', 'clue_completions INTEGER, rank INTEGER', 'clue_completions, rank'),
+    }
+    excluded = {
+        'skilling': ['overall', 'hitpoints', 'magic'],
+        'bossing': ['tempoross', 'wintertodt', 'zalcano', 'guardians_of_the_rift'],
+        'clues': ['clue_scrolls_all', 'clue_scrolls_beginner'],
+    }
+
+    # A wide-only database, or a metric first seen after switching to wide, has layout names but no long rows.
+    cursor.execute('SELECT id, layout FROM wide_layouts')
+    layouts = [(layout_id, json.loads(layout)) for layout_id, layout in cursor.fetchall()]
+    for _, layout in layouts:
+        for table, names in layout.items():
+            cursor.executemany('INSERT OR IGNORE INTO metrics (kind, wom_value, display_name) VALUES (?, ?, ?)',
+                               [(table, wom_value(name), name) for name in names])
+
+    for table, (name_column, value_columns, values) in fact_tables.items():
+        # Stored names were title-cased WOM enum values, so the enum value can be recovered from them.
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO metrics (kind, wom_value, display_name)
+        SELECT DISTINCT ?, lower(replace({name_column}, ' ', '_')), {name_column}
+        FROM {table}
+        WHERE {name_column} IS NOT NULL
+        ''', (table,))
+        cursor.executemany('UPDATE metrics SET excluded_from_efficiency = 1 WHERE kind = ? AND wom_value = ?',
+                           [(table, wom_value) for wom_value in excluded[table]])
+
+        cursor.execute(f'''
+        CREATE TABLE {table}_interned (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER NOT NULL,
+            metric_id INTEGER NOT NULL,
+            {value_columns},
+            snapshot_date TIMESTAMP,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (player_id) REFERENCES players(id),
+            FOREIGN KEY (metric_id) REFERENCES metrics(id)
+        )
+        ''')
+        cursor.execute(f'''
+        INSERT INTO {table}_interned (id, player_id, metric_id, {values}, snapshot_date, created_date)
+        SELECT t.id, t.player_id, m.id, {', '.join(f't.{column}' for column in values.split(', '))}, t.snapshot_date, t.created_date
+        FROM {table} t
+        JOIN metrics m
+        ON m.kind = ? AND m.display_name = t.{name_column}
+        ''', (table,))
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_interned RENAME TO {table}')
+
+        cursor.execute(f'CREATE UNIQUE INDEX ux_{table}_snapshot ON {table} (player_id, metric_id, snapshot_date)')
+        cursor.execute(f'CREATE INDEX ix_{table}_report ON {table} (player_id, metric_id, created_date)')
+
+    # Wide layouts listed metric names; point them at the interned ids instead.
+    for layout_id, layout in layouts:
+        for table, names in layout.items():
+            cursor.execute('SELECT wom_value, id FROM metrics WHERE kind = ?', (table,))
+            metric_ids = dict(cursor.fetchall())
+            layout[table] = [metric_ids[wom_value(name)] for name in names]
+        cursor.execute('UPDATE wide_layouts SET layout = ? WHERE id = ?', (json.dumps(layout, sort_keys=True), layout_id))
+
+
+def wom_value(name: str) -> str:
+    # Same recovery as the lower(replace()) in intern_metrics' SQL.
+    return name.lower().replace(' ', '_')
+
+
+def add_baseline_latest(cursor: sqlite3.Cursor) -> None:
+    for table in ['baseline', 'latest']:
+        previous_columns = 'previous_value NUMERIC, previous_eff FLOAT,' if table == 'latest' else ''
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            player_id INTEGER NOT NULL,
+            metric_id INTEGER NOT NULL,
+            value NUMERIC,
+            eff FLOAT,
+            rank INTEGER,
+            {previous_columns}
+            snapshot_date TIMESTAMP,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (player_id, metric_id),
+            FOREIGN KEY (player_id) REFERENCES players(id),
+            FOREIGN KEY (metric_id) REFERENCES metrics(id)
+        )
+        ''')
+
+    fill_baseline_latest(cursor)
+
+
+def fill_baseline_latest(cursor: sqlite3.Cursor) -> None:
+    # Backfill both from history, in the created_date order the reports diff over; rebuild_snapshots reuses this.
+    fact_tables = {
+        'skilling': ('exp', 'ehp'),
+        'bossing': ('kills', 'ehb'),
+        'clues': ('clue_completions', 'NULL'),
+    }
+    for table, (value, eff) in fact_tables.items():
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO baseline (player_id, metric_id, value, eff, rank, snapshot_date, created_date)
+        SELECT player_id, metric_id, value, eff, rank, snapshot_date, created_date
+        FROM (
+            SELECT
+                player_id, metric_id, {value} AS value, {eff} AS eff, rank, snapshot_date, created_date,
+                ROW_NUMBER() OVER (PARTITION BY player_id, metric_id ORDER BY created_date, id) AS row_number
+            FROM {table}
+        )
+        WHERE row_number = 1
+        ''')
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO latest (player_id, metric_id, value, eff, rank, previous_value, previous_eff, snapshot_date, created_date)
+        SELECT player_id, metric_id, value, eff, rank, previous_value, previous_eff, snapshot_date, created_date
+        FROM (
+            SELECT
+                player_id, metric_id, {value} AS value, {eff} AS eff, rank, snapshot_date, created_date,
+                LEAD({value}) OVER newest_first AS previous_value,
+                LEAD({eff}) OVER newest_first AS previous_eff,
+                ROW_NUMBER() OVER newest_first AS row_number
+            FROM {table}
+            WINDOW newest_first AS (PARTITION BY player_id, metric_id ORDER BY created_date DESC, id DESC)
+        )
+        WHERE row_number = 1
+        ''')
+
+
+def add_efficiency_tables(cursor: sqlite3.Cursor) -> None:
+    # Local copies of the Efficiency sheet rates and the scores computed from them.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS efficiency_rates (
+        metric_id INTEGER PRIMARY KEY,
+        per_hour FLOAT NOT NULL,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (metric_id) REFERENCES metrics(id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS player_efficiency (
+        player_id INTEGER PRIMARY KEY,
+        ehb FLOAT,
+        ehp FLOAT,
+        ehc FLOAT,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+    ''')
+
+
+def add_bingo_tiles(cursor: sqlite3.Cursor) -> None:
+    # Tile results per player and per team, and how far the latest table has been evaluated for each board.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bingo_player_tiles (
+        tile TEXT NOT NULL,
+        player_id INTEGER NOT NULL,
+        value FLOAT,
+        progress FLOAT,
+        complete INTEGER,
+        modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (tile, player_id),
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bingo_team_tiles (
+        tile TEXT NOT NULL,
+        team TEXT NOT NULL,
+        value FLOAT,
+        progress FLOAT,
+        complete INTEGER,
+        modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (tile, team)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bingo_state (
+        board_hash TEXT PRIMARY KEY,
+        evaluated_through TIMESTAMP,
+        modified_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def add_snapshot_markers(cursor: sqlite3.Cursor) -> None:
+    # One row per player snapshot, so readers know a snapshot happened even when changes-only writes stored no rows.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS snapshot_markers (
+        player_id INTEGER NOT NULL,
+        snapshot_date TIMESTAMP NOT NULL,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (player_id, snapshot_date),
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    )
+    ''')
+    cursor.execute('''
+    INSERT OR IGNORE INTO snapshot_markers (player_id, snapshot_date, created_date)
+    SELECT player_id, snapshot_date, MAX(created_date)
+    FROM (
+        SELECT player_id, snapshot_date, created_date FROM skilling
+        UNION ALL
+        SELECT player_id, snapshot_date, created_date FROM bossing
+        UNION ALL
+        SELECT player_id, snapshot_date, created_date FROM clues
+        UNION ALL
+        SELECT player_id, snapshot_date, created_date FROM wide_snapshots
+    )
+    GROUP BY player_id, snapshot_date
+    ''')
+
+
+MIGRATIONS = [
+    create_base_tables,
+    track_player_snapshots,
+    add_fetch_jobs,
+    add_snapshot_archive,
+    add_report_indexes,
+    unique_player_rsn,
+    add_wide_snapshots,
+    intern_metrics,
+    add_baseline_latest,
+    add_efficiency_tables,
+    add_bingo_tiles,
+    add_snapshot_markers,
+]
+
+
+def create_unique_index(cursor: sqlite3.Cursor, name: str, table: str, columns: list) -> None:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+    if cursor.fetchone():
+        return
+
+    # Older databases hold a copy of every unchanged snapshot; keep the first one.
+    column_list = ', '.join(columns)
+    cursor.execute(f'''
+    DELETE FROM {table}
+    WHERE id NOT IN (
+        SELECT MIN(id) FROM {table} GROUP BY {column_list}
+    )
+    ''')
+    cursor.execute(f'CREATE UNIQUE INDEX {name} ON {table} ({column_list})')
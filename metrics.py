@@ -0,0 +1,37 @@
+import sqlite3
+
+# Left out of the Efficiency sheet's EHB/EHP/EHC sums, keyed by fact table.
+EXCLUDED_FROM_EFFICIENCY = {
+    'skilling': {'overall', 'hitpoints', 'magic'},
+    'bossing': {'tempoross', 'wintertodt', 'zalcano', 'guardians_of_the_rift'},
+    'clues': {'clue_scrolls_all', 'clue_scrolls_beginner'},
+}
+
+
+def display_name(kind: str, metric) -> str:
+    # Same names the fact tables stored as text before metrics were interned.
+    if kind == 'skilling':
+        return metric.name
+    return metric.value.replace('_', ' ').title()
+
+
+class MetricCache:
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, kind, wom_value FROM metrics')
+        self.ids = {(kind, wom_value): metric_id for metric_id, kind, wom_value in cursor.fetchall()}
+
+    def metric_id(self, kind: str, metric) -> int:
+        key = (kind, metric.value)
+        metric_id = self.ids.get(key)
+        if metric_id is None:
+            # New WOM metrics are rare; the insert commits with the caller's next transaction.
+            cursor = self.conn.cursor()
+            cursor.execute('''
+            INSERT OR IGNORE INTO metrics (kind, wom_value, display_name, excluded_from_efficiency)
+            VALUES (?, ?, ?, ?)
+            ''', (kind, metric.value, display_name(kind, metric), metric.value in EXCLUDED_FROM_EFFICIENCY[kind]))
+            cursor.execute('SELECT id FROM metrics WHERE kind = ? AND wom_value = ?', key)
+            metric_id = self.ids[key] = cursor.fetchone()[0]
+        return metric_id
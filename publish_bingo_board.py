@@ -0,0 +1,7 @@
+import report_engine
+
+def main() -> None:
+    report_engine.main(['bingo_board'])
+
+if __name__ == '__main__':
+    main()
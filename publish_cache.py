@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+
+PUBLISH_CACHE_DIR = os.getenv('PUBLISH_CACHE_DIR', '.publish_cache')
+# Set after editing a sheet by hand, so the next run rewrites every row instead of trusting the cache.
+PUBLISH_FULL_REWRITE = os.getenv('PUBLISH_FULL_REWRITE', '0') == '1'
+
+
+def cache_path(spreadsheet_id: str, sheet_title: str) -> str:
+    return os.path.join(PUBLISH_CACHE_DIR, spreadsheet_id, f'{sheet_title}.json')
+
+
+def row_hashes(values: list) -> list:
+    return [hashlib.sha1(json.dumps(row, default=str).encode()).hexdigest() for row in values]
+
+
+def load(spreadsheet_id: str, sheet_title: str):
+    if PUBLISH_FULL_REWRITE:
+        return None
+    try:
+        with open(cache_path(spreadsheet_id, sheet_title)) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+
+def save(spreadsheet_id: str, sheet_title: str, hashes: list) -> None:
+    path = cache_path(spreadsheet_id, sheet_title)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so an interrupted run never leaves a cache that claims rows were published.
+    with open(f'{path}.tmp', 'w') as cache_file:
+        json.dump(hashes, cache_file)
+    os.replace(f'{path}.tmp', path)
+
+
+def changed_row_runs(cached: list, hashes: list) -> list:
+    # (first, last) zero-based row indexes of each contiguous run of rows that differ from the cache.
+    runs = []
+    for index, digest in enumerate(hashes):
+        if index < len(cached) and cached[index] == digest:
+            continue
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return [tuple(run) for run in runs]
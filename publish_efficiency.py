@@ -0,0 +1,7 @@
+import report_engine
+
+def main() -> None:
+    report_engine.main(['efficiency'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import sqlite3
+import time
+import db
+import make_migrations
+import metrics
+import snapshot_archive
+import wide_store
+from snapshot_writer import COLUMNS, SNAPSHOT_WRITE_MODE, build_rows, changed_rows, insert_sql
+
+CHUNK_SIZE = 500
+
+
+def main() -> None:
+    make_migrations.run()
+
+    conn = db.connect()
+    read_cursor = conn.cursor()
+    write_cursor = conn.cursor()
+
+    # Rows are re-inserted with their original ingest time so report ordering is unchanged.
+    inserts = {table: insert_sql(table, columns + ('created_date',)) for table, columns in COLUMNS.items()}
+    rows = {table: [] for table in COLUMNS}
+    wide = []
+    layouts = wide_store.LayoutCache(conn)
+    metric_cache = metrics.MetricCache(conn)
+    # Changes-only databases stay sparse: each player's values carry forward from their previous rebuilt snapshot.
+    last_values = {}
+
+    start = time.monotonic()
+    snapshots = 0
+
+    with conn:
+        # Only snapshots in the archive can be regenerated; older history is left alone.
+        for table in [*COLUMNS, 'wide_snapshots']:
+            write_cursor.execute(f'''
+            DELETE FROM {table}
+            WHERE (player_id, snapshot_date) IN (
+                SELECT player_id, snapshot_date FROM snapshot_archive_index
+            )
+            ''')
+
+        read_cursor.execute('''
+        SELECT i.player_id, i.created_date, a.payload
+        FROM snapshot_archive_index i
+        JOIN snapshot_archive a
+        ON a.hash = i.hash
+        ORDER BY i.player_id, i.snapshot_date
+        ''')
+        for player_id, created_date, payload in read_cursor:
+            player_detail = snapshot_archive.decode_payload(payload)
+            player_rows = build_rows(player_id, player_detail, metric_cache)
+            if wide_store.writes_long():
+                long_rows = changed_rows(player_rows, last_values) if SNAPSHOT_WRITE_MODE == 'changes' else player_rows
+                for table, table_rows in long_rows.items():
+                    rows[table].extend(row + (created_date,) for row in table_rows)
+            if wide_store.writes_wide():
+                layout, row = wide_store.wide_entry(player_rows)
+                wide.append((layout, row + (created_date,)))
+            snapshots += 1
+
+            if snapshots % CHUNK_SIZE == 0:
+                flush(write_cursor, inserts, rows, layouts, wide)
+
+        flush(write_cursor, inserts, rows, layouts, wide)
+
+        # baseline and latest come from the rows just regenerated, read through the wide adapter without long rows.
+        if not wide_store.writes_long():
+            for table in wide_store.FIELDS:
+                wide_store.load_long_table(conn, table)
+        write_cursor.execute('DELETE FROM baseline')
+        write_cursor.execute('DELETE FROM latest')
+        make_migrations.fill_baseline_latest(write_cursor)
+        # A metric with no row in its player's newest snapshot did not move in it, as the writer records it.
+        write_cursor.execute('''
+        UPDATE latest
+        SET previous_value = value, previous_eff = eff, snapshot_date = m.snapshot_date, created_date = m.created_date
+        FROM (
+            SELECT player_id, MAX(snapshot_date) AS snapshot_date, created_date
+            FROM snapshot_markers
+            GROUP BY player_id
+        ) m
+        WHERE m.player_id = latest.player_id AND latest.snapshot_date < m.snapshot_date
+        ''')
+        # The tiles only re-evaluate what moved in latest, so the next bingo run starts over.
+        write_cursor.execute('DELETE FROM bingo_state')
+
+    conn.close()
+
+    print(f'rebuilt {snapshots} snapshots in {time.monotonic() - start:.1f}s')
+
+
+def flush(cursor: sqlite3.Cursor, inserts: dict, rows: dict, layouts: wide_store.LayoutCache, wide: list) -> None:
+    for table, table_rows in rows.items():
+        cursor.executemany(inserts[table], table_rows)
+        table_rows.clear()
+    wide_store.store(cursor, layouts, wide, with_created_date=True)
+    wide.clear()
+
+
+if __name__ == '__main__':
+    main()
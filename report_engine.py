@@ -0,0 +1,394 @@
+import math
+import os
+import bingo_tiles
+import db
+import efficiency
+import numpy as np
+import pandas as pd
+import publish_cache
+import report_queries
+import wide_store
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sheets_session import PublishSession, col_num_to_letter
+
+SPREADSHEET_ID = '1i7OSaNlZIUyLtgLmXV4F9S-UIYhMWg8DLRb11BbAX-U'
+# Days from the Sheets epoch (1899-12-30) to the unix epoch.
+SHEETS_EPOCH_DAYS = 25569
+DATETIME_FORMAT = {'type': 'DATE_TIME', 'pattern': 'yyyy-mm-dd hh:mm:ss'}
+# Processes that read sources and build report frames side by side; 1 builds everything in this process.
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 1))
+# History mode reads this many players at a time; 0 reads the whole table at once.
+REPORT_CHUNK_PLAYERS = int(os.getenv('REPORT_CHUNK_PLAYERS', 0))
+
+# Names are categoricals and counts int32; exp overflows int32, and the eff columns stay float64
+# because float32 would change the decimals published to the sheets.
+CATEGORY_COLUMNS = ['rsn', 'team', 'boss_name', 'skill_name', 'clue_type', 'wom_value']
+INT32_VALUES = ['kills', 'clue_completions']
+
+# Each source table is read once per run, however many reports use it.
+SOURCES = {
+    'bossing': {'name_column': 'boss_name', 'value_columns': ['kills', 'ehb']},
+    'skilling': {'name_column': 'skill_name', 'value_columns': ['exp', 'ehp']},
+    'clues': {'name_column': 'clue_type', 'value_columns': ['clue_completions']},
+    'stats': {'name_column': None, 'value_columns': ['ehb', 'ehp', 'ehc']},
+}
+
+# columns: per metric report columns, all of them when left out; every row also gets one created_date.
+# column_width: pixel width set on every column when the sheet is first created.
+# metrics: WOM enum values to keep, all of them when left out.
+REPORTS = {
+    'bossing': {
+        'source': 'bossing',
+        'sheet': 'Bossing Report',
+        'column_width': 200,
+    },
+    'skilling': {
+        'source': 'skilling',
+        'sheet': 'Skilling Report',
+        'column_width': 200,
+    },
+    'clues': {
+        'source': 'clues',
+        'sheet': 'Clues Report',
+        'column_width': 200,
+    },
+    'stats': {
+        'source': 'stats',
+        'sheet': 'Basic Stats Report',
+    },
+    'bingo_exp': {
+        'source': 'skilling',
+        'sheet': 'Bingo Skills EXP',
+        'column_width': 200,
+        'metrics': ['firemaking', 'agility', 'mining', 'slayer'],
+        'columns': ['cumulative_exp'],
+    },
+}
+
+
+def typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    for value in INT32_VALUES:
+        for column in (value, f'delta_{value}', f'cumulative_{value}'):
+            # Missing values keep a float column.
+            if column in df and df[column].notna().all():
+                df[column] = df[column].astype('int32')
+    if 'excluded_from_efficiency' in df:
+        df['excluded_from_efficiency'] = df['excluded_from_efficiency'].astype('int8')
+    return df
+
+
+def history_chunks(conn, table: str):
+    # Whole players per chunk, so no player's history is split between two diffs.
+    source = SOURCES[table]
+    if REPORT_CHUNK_PLAYERS <= 0:
+        yield typed_frame(pd.read_sql_query(report_queries.history_query(table, source['name_column'], source['value_columns']), conn))
+        return
+
+    query = report_queries.history_query(table, source['name_column'], source['value_columns'], 'WHERE t.player_id BETWEEN ? AND ?')
+    player_ids = [row[0] for row in conn.execute('SELECT id FROM players ORDER BY id')]
+    for start in range(0, len(player_ids), REPORT_CHUNK_PLAYERS):
+        chunk = player_ids[start:start + REPORT_CHUNK_PLAYERS]
+        yield typed_frame(pd.read_sql_query(query, conn, params=(chunk[0], chunk[-1])))
+
+
+def latest_rows(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    # The newest row per player (and metric) with its delta from the previous snapshot and its change since the first.
+    source = SOURCES[table]
+    name_column = source['name_column']
+    keys = ['rsn', name_column] if name_column else ['rsn']
+    df = df.sort_values(by=['team', *keys, 'created_date'])
+    for value in source['value_columns']:
+        if df[value].dtype == object:
+            # A column no snapshot fills (stats.ehc) reads back as all None.
+            df[value] = df[value].astype(float)
+        df[f'delta_{value}'] = df.groupby(keys, observed=True)[value].diff().fillna(0).astype(df[value].dtype)
+        df[f'cumulative_{value}'] = df.groupby(keys, observed=True)[f'delta_{value}'].cumsum()
+    return df.groupby(keys, observed=True).tail(1)
+
+
+def load_source(conn, table: str) -> pd.DataFrame:
+    source = SOURCES[table]
+    name_column, value_columns = source['name_column'], source['value_columns']
+
+    if report_queries.REPORT_SOURCE == 'materialized' and name_column:
+        return typed_frame(pd.read_sql_query(report_queries.materialized_query(table, name_column, *value_columns), conn))
+    if report_queries.REPORT_SOURCE == 'window':
+        df = pd.read_sql_query(report_queries.window_query(table, name_column, value_columns), conn)
+        for value in value_columns:
+            if df[value].dtype == object:
+                # stats.ehc reads back as all None here too, and publishes blank like the history frames.
+                df[value] = df[value].astype(float)
+        return typed_frame(df)
+
+    df = pd.concat([latest_rows(chunk, table) for chunk in history_chunks(conn, table)], ignore_index=True)
+    # Chunks carry their own categories, which concat turns back into objects.
+    keys = ['rsn', name_column] if name_column else ['rsn']
+    return typed_frame(df).sort_values(by=['team', *keys], ignore_index=True)
+
+
+def build_report(report: dict, source_df: pd.DataFrame) -> pd.DataFrame:
+    source = SOURCES[report['source']]
+    name_column = source['name_column']
+    columns = report.get('columns')
+    if columns is None:
+        columns = [column for value in source['value_columns'] for column in (value, f'delta_{value}', f'cumulative_{value}')]
+
+    if not name_column:
+        report_df = source_df[['rsn', 'team', *columns, 'created_date']].copy()
+        report_df['created_date'] = sheets_datetime(report_df['created_date'])
+        return report_df
+
+    df = source_df
+    if 'metrics' in report:
+        df = df[df['wom_value'].isin(report['metrics'])]
+
+    return dense_report(df, name_column, columns)
+
+
+def dense_report(df: pd.DataFrame, name_column: str, columns: list) -> pd.DataFrame:
+    # Scatters each (player, metric) row into one float matrix by integer codes instead of pivoting object columns.
+    # rsn is unique per player, so players come out sorted by rsn and metrics in first-seen order, as the pivot laid them out.
+    player_codes, players = pd.factorize(df['rsn'], sort=True)
+    metric_codes, metric_names = pd.factorize(df[name_column])
+
+    matrix = np.full((len(players), len(metric_names) * len(columns)), np.nan)
+    for offset, column in enumerate(columns):
+        matrix[player_codes, metric_codes * len(columns) + offset] = df[column].to_numpy(dtype=float)
+
+    teams = np.empty(len(players), dtype=object)
+    teams[player_codes] = df['team'].to_numpy()
+
+    # One timestamp per player instead of a created_date column per metric.
+    date_codes, dates = pd.factorize(df['created_date'], sort=True)
+    newest = np.full(len(players), -1)
+    np.maximum.at(newest, player_codes, date_codes)
+
+    headers = [f'{column}_{name}' for name in metric_names for column in columns]
+    report_df = pd.DataFrame(matrix, columns=headers)
+    report_df.insert(0, 'rsn', players)
+    report_df.insert(1, 'team', teams)
+    report_df['created_date'] = sheets_datetime(pd.Series(dates[newest]))
+    return report_df
+
+
+def sheets_datetime(values: pd.Series) -> pd.Series:
+    # Sheets stores datetimes as days since 1899-12-30; sending that number keeps the cell a real date.
+    return (values + SHEETS_EPOCH_DAYS * 86400) / 86400
+
+
+def sheet_values(report_df: pd.DataFrame) -> list:
+    # Column by column, so numeric columns unbox straight from their arrays rather than through an object matrix.
+    values = [report_df.columns.tolist()]
+    for row in zip(*(report_df[column].tolist() for column in report_df.columns)):
+        cells = []
+        for value in row:
+            if isinstance(value, float):
+                if math.isnan(value):
+                    value = ''
+                elif value.is_integer():
+                    value = int(value)
+            cells.append(value)
+        values.append(cells)
+    return values
+
+
+def publish(session: PublishSession, report: dict, report_df: pd.DataFrame) -> int:
+    sheet_title = report['sheet']
+    values = sheet_values(report_df)
+    rows, columns = len(values), len(values[0])
+
+    created = session.ensure_sheet(sheet_title, rows, columns)
+    if created and 'column_width' in report:
+        session.set_column_width(sheet_title, columns, report['column_width'])
+
+    return queue_values(session, sheet_title, values, created)
+
+
+def publish_efficiency(session: PublishSession, scores_df: pd.DataFrame) -> int:
+    # Plain numbers in the RSN..EHC columns; the rate tables to their right are left alone.
+    values = sheet_values(scores_df[list(efficiency.EFFICIENCY_COLUMNS)].rename(columns=efficiency.EFFICIENCY_COLUMNS))
+    created = session.ensure_sheet(efficiency.EFFICIENCY_SHEET, len(values), len(values[0]))
+    return queue_values(session, efficiency.EFFICIENCY_SHEET, values, created, owns_sheet=False)
+
+
+def publish_board(session: PublishSession, board_df: pd.DataFrame) -> int:
+    values = sheet_values(board_df)
+    created = session.ensure_sheet(bingo_tiles.BINGO_SHEET, len(values), len(values[0]))
+    if created:
+        session.set_column_width(bingo_tiles.BINGO_SHEET, len(values[0]), 200)
+    return queue_values(session, bingo_tiles.BINGO_SHEET, values, created)
+
+
+def queue_values(session: PublishSession, sheet_title: str, values: list, created: bool, owns_sheet: bool = True) -> int:
+    # owns_sheet=False keeps clears inside the written columns, for sheets that hold other data beside the report.
+    hashes = publish_cache.row_hashes(values)
+    cached = None if created else publish_cache.load(SPREADSHEET_ID, sheet_title)
+    width = len(values[0])
+    last_column = col_num_to_letter(width)
+    clear_end_column = None if owns_sheet else width
+
+    # The header row carries the column layout; when it changes every row has to be rewritten.
+    if 'created_date' in values[0] and (not cached or cached[0] != hashes[0] or len(cached) != len(values)):
+        session.format_column(sheet_title, values[0].index('created_date'), len(values), DATETIME_FORMAT)
+
+    if not cached or cached[0] != hashes[0]:
+        session.write(f'{sheet_title}!A1:{last_column}{len(values)}', values)
+        session.clear(sheet_title, len(values), end_column=clear_end_column)
+        if owns_sheet:
+            session.clear(sheet_title, 0, len(values), width)
+        session.cache_rows(sheet_title, hashes)
+        return len(values) * width
+
+    cells = 0
+    for first, last in publish_cache.changed_row_runs(cached, hashes):
+        session.write(f'{sheet_title}!A{first + 1}:{last_column}{last + 1}', values[first:last + 1])
+        cells += (last + 1 - first) * width
+    if len(cached) > len(values):
+        session.clear(sheet_title, len(values), len(cached), end_column=clear_end_column)
+    session.cache_rows(sheet_title, hashes)
+    return cells
+
+
+def compute_source(table: str, report_names: list, keep_source: bool) -> tuple:
+    # One source read and every report frame built from it; runs in a worker process when REPORT_WORKERS > 1.
+    conn = db.connect_readonly()
+    reads_facts = report_queries.REPORT_SOURCE != 'materialized' or table == 'stats'
+    if reads_facts and wide_store.STORAGE_ENGINE == 'wide':
+        wide_store.load_long_table(conn, table)
+    source_df = load_source(conn, table)
+    conn.close()
+
+    frames = {}
+    failures = {}
+    for name in report_names:
+        try:
+            frames[name] = build_report(REPORTS[name], source_df)
+        except Exception as error:
+            failures[name] = failure_message(error)
+    return (source_df if keep_source else None), frames, failures
+
+
+def submit_sources(pool, jobs: dict, keep_sources: set) -> dict:
+    if pool is None:
+        return {}
+    return {
+        table: pool.submit(compute_source, table, report_names, table in keep_sources)
+        for table, report_names in jobs.items()
+    }
+
+
+def collect_sources(futures: dict, jobs: dict, keep_sources: set) -> dict:
+    # table -> (source_df, frames, build failures), or the load failure message; tables without a future are computed here.
+    results = {}
+    for table, report_names in jobs.items():
+        try:
+            if table in futures:
+                results[table] = futures[table].result()
+            else:
+                results[table] = compute_source(table, report_names, table in keep_sources)
+        except Exception as error:
+            results[table] = failure_message(error)
+    return results
+
+
+def failure_message(error: Exception) -> str:
+    return f'{type(error).__name__}: {error}'
+
+
+def print_failures(failures: dict) -> None:
+    # Stages in run order and names in REPORTS order, so two failing runs print the same report.
+    for stage, stage_failures in failures.items():
+        for name, message in stage_failures.items():
+            print(f'{stage} failed for {name}: {message}')
+
+
+def main(names: list = None) -> None:
+    # 'efficiency' names the EHB/EHP/EHC scores on the Efficiency sheet and 'bingo_board' the tile results
+    # on the Bingo Board sheet; a full run publishes them too.
+    names = names or [*REPORTS, 'efficiency', *(['bingo_board'] if os.path.exists(bingo_tiles.BINGO_BOARD) else [])]
+    reports = {name: REPORTS[name] for name in REPORTS if name in names}
+    with_efficiency = 'efficiency' in names
+    efficiency_tables = {score['source'] for score in efficiency.SCORES.values()} if with_efficiency else set()
+
+    jobs = {
+        table: [name for name, report in reports.items() if report['source'] == table]
+        for table in SOURCES
+        if table in efficiency_tables or any(report['source'] == table for report in reports.values())
+    }
+    failures = {'load': {}, 'build': {}, 'session': {}, 'efficiency': {}, 'bingo_board': {}, 'publish': {}, 'flush': {}}
+
+    # Workers fork before the Sheets thread starts; the client, its metadata read and the Efficiency rate read
+    # then overlap the report computation.
+    pool = ProcessPoolExecutor(max_workers=min(REPORT_WORKERS, len(jobs))) if REPORT_WORKERS > 1 and len(jobs) > 1 else None
+    futures = submit_sources(pool, jobs, efficiency_tables)
+    with ThreadPoolExecutor(max_workers=1) as io:
+        session_future = io.submit(PublishSession, SPREADSHEET_ID)
+        rates_future = io.submit(lambda: efficiency.refresh_rates(session_future.result())) if with_efficiency else None
+        results = collect_sources(futures, jobs, efficiency_tables)
+        try:
+            session = session_future.result()
+        except Exception as error:
+            failures['session']['sheets'] = failure_message(error)
+            session = None
+        if rates_future is not None and session is not None:
+            try:
+                rates_future.result()
+            except Exception as error:
+                # Scores still come from the rates saved by the last good read.
+                failures['efficiency']['rates'] = failure_message(error)
+    if pool is not None:
+        pool.shutdown()
+
+    sources = {}
+    frames = {}
+    for table, result in results.items():
+        if isinstance(result, str):
+            failures['load'][table] = result
+            continue
+        source_df, table_frames, build_failures = result
+        sources[table] = source_df
+        frames.update(table_frames)
+        failures['build'].update(build_failures)
+    failures['build'] = {name: failures['build'][name] for name in reports if name in failures['build']}
+
+    if session is not None:
+        for name, report in reports.items():
+            if name not in frames:
+                continue
+            try:
+                cells = publish(session, report, frames[name])
+                print(f'{cells} cells queued for {name} report')
+            except Exception as error:
+                failures['publish'][name] = failure_message(error)
+
+        if with_efficiency and efficiency_tables <= set(sources):
+            try:
+                cells = publish_efficiency(session, efficiency.update(sources))
+                print(f'{cells} cells queued for efficiency scores')
+            except Exception as error:
+                failures['efficiency']['scores'] = failure_message(error)
+
+        if 'bingo_board' in names:
+            try:
+                print(f'{bingo_tiles.update()} bingo tile results updated')
+                cells = publish_board(session, bingo_tiles.board_frame())
+                print(f'{cells} cells queued for bingo board')
+            except Exception as error:
+                failures['bingo_board']['tiles'] = failure_message(error)
+
+        try:
+            print(f'{session.flush()} cells updated.')
+        except Exception as error:
+            failures['flush']['sheets'] = failure_message(error)
+
+    if any(failures.values()):
+        print_failures(failures)
+        raise SystemExit('reports failed')
+    print('done with reports')
+
+
+if __name__ == '__main__':
+    main()
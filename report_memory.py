@@ -0,0 +1,47 @@
+import sys
+import time
+import tracemalloc
+import db
+import pandas as pd
+import report_engine
+import report_queries
+
+# Prints rows, frame size and peak allocation for each way of loading the report sources.
+# Usage: python report_memory.py [players per chunk, default 100]
+
+
+def measure(label: str, load) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        df = load()
+    except Exception as error:
+        tracemalloc.stop()
+        print(f'{label:<34}failed: {error}')
+        return
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label:<34}{len(df):>10}{df.memory_usage(deep=True).sum() / 2**20:>12.1f}{peak / 2**20:>12.1f}{seconds:>9.2f}')
+
+
+def main() -> None:
+    chunk_players = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    conn = db.connect_readonly()
+    print(f'{"":<34}{"rows":>10}{"frame MiB":>12}{"peak MiB":>12}{"seconds":>9}')
+
+    for table, source in report_engine.SOURCES.items():
+        query = report_queries.history_query(table, source['name_column'], source['value_columns'])
+        measure(f'{table} history, untyped', lambda: pd.read_sql_query(query, conn))
+        measure(f'{table} history, typed', lambda: report_engine.typed_frame(pd.read_sql_query(query, conn)))
+
+        report_engine.REPORT_CHUNK_PLAYERS = 0
+        measure(f'{table} report source', lambda: report_engine.load_source(conn, table))
+        report_engine.REPORT_CHUNK_PLAYERS = chunk_players
+        measure(f'{table} report source, chunked', lambda: report_engine.load_source(conn, table))
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
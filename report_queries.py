@@ -0,0 +1,163 @@
+import os
+
+# history: diff the full snapshot history in pandas (default), window: let SQLite keep only the newest rows,
+# materialized: read the baseline/latest tables.
+REPORT_SOURCE = os.getenv('REPORT_SOURCE', 'history')
+
+
+def epoch(column: str, alias: str = 'created_date') -> str:
+    # Every query returns created_date as unix seconds, so pandas never parses timestamp text.
+    return f"CAST(strftime('%s', {column}) AS INTEGER) AS {alias}"
+
+
+# Each player's newest snapshot marker.
+NEWEST_MARKERS = '''(
+        SELECT player_id, MAX(snapshot_date) AS snapshot_date, created_date
+        FROM snapshot_markers
+        GROUP BY player_id
+    )'''
+
+
+def as_of_query(table: str, value_columns: list, markers: str = 'snapshot_markers') -> str:
+    # Every metric as of each marker: the last row stored at or before the marker's snapshot, stamped with the marker's
+    # snapshot and created_date. With changes-only writes that row can be older, and its value carries forward.
+    # markers is any (player_id, snapshot_date, created_date) table or subquery; all of snapshot_markers rebuilds every snapshot.
+    columns = ''.join(f't.{value}, ' for value in value_columns)
+    return f'''
+        SELECT t.id, m.player_id, t.metric_id, {columns}MAX(t.snapshot_date) AS stored_snapshot_date, m.snapshot_date, m.created_date
+        FROM {markers} m
+        JOIN {table} t
+        ON t.player_id = m.player_id AND t.snapshot_date <= m.snapshot_date
+        GROUP BY m.player_id, m.snapshot_date, t.metric_id
+    '''
+
+
+def metric_history(table: str, value_columns: list) -> str:
+    # The rows stored before each player's newest snapshot, then every metric as of that snapshot, so the newest row
+    # of every metric carries the newest snapshot's created_date and the diffs see 0 for metrics it did not change.
+    stored = ''.join(f't.{value}, ' for value in value_columns)
+    values = ''.join(f'{value}, ' for value in value_columns)
+    return f'''(
+        SELECT t.id, t.player_id, t.metric_id, {stored}t.snapshot_date, t.created_date
+        FROM {table} t
+        LEFT JOIN {NEWEST_MARKERS} s
+        ON s.player_id = t.player_id
+        WHERE s.snapshot_date IS NULL OR t.snapshot_date IS NULL OR t.snapshot_date < s.snapshot_date
+        UNION ALL
+        SELECT id, player_id, metric_id, {values}snapshot_date, created_date
+        FROM ({as_of_query(table, value_columns, NEWEST_MARKERS)})
+    )'''
+
+
+def history_query(table: str, name_column: str, value_columns: list, where: str = '') -> str:
+    columns = ''.join(f't.{value},\n        ' for value in value_columns)
+
+    source = table
+    metric_columns = metric_join = order = ''
+    if name_column:
+        source = metric_history(table, value_columns)
+        metric_columns = f'm.display_name AS {name_column},\n        m.wom_value,\n        m.excluded_from_efficiency,'
+        metric_join = f"JOIN metrics m\n    ON t.metric_id = m.id AND m.kind = '{table}'"
+        order = ', m.display_name'
+
+    return f'''
+    SELECT
+        p.rsn,
+        p.team,
+        {metric_columns}
+        {columns}{epoch('t.created_date')}
+    FROM {source} t
+    JOIN players p
+    ON t.player_id = p.id
+    {metric_join}
+    {where}
+    ORDER BY p.team, p.rsn{order}, t.created_date, t.snapshot_date
+    '''
+
+
+def materialized_query(kind: str, name_column: str, value_column: str, eff_column: str = None, where: str = '') -> str:
+    # Same per player and metric columns the history reports keep after tail(1).
+    columns = [
+        f'l.value AS {value_column}',
+        f'COALESCE(l.value - l.previous_value, 0) AS delta_{value_column}',
+        f'l.value - b.value AS cumulative_{value_column}',
+    ]
+    if eff_column:
+        columns += [
+            f'l.eff AS {eff_column}',
+            f'COALESCE(l.eff - l.previous_eff, 0) AS delta_{eff_column}',
+            f'l.eff - b.eff AS cumulative_{eff_column}',
+        ]
+    column_list = ',\n        '.join(columns)
+
+    return f'''
+    SELECT
+        p.rsn,
+        p.team,
+        m.display_name AS {name_column},
+        m.wom_value,
+        m.excluded_from_efficiency,
+        {column_list},
+        {epoch('l.created_date')}
+    FROM latest l
+    JOIN baseline b
+    ON b.player_id = l.player_id AND b.metric_id = l.metric_id
+    JOIN players p
+    ON l.player_id = p.id
+    JOIN metrics m
+    ON l.metric_id = m.id
+    WHERE m.kind = '{kind}' {where}
+    ORDER BY p.team, p.rsn, m.display_name
+    '''
+
+
+def window_query(table: str, name_column: str, value_columns: list, where: str = '') -> str:
+    # Only the newest row per partition leaves SQLite. Stats windows run over the ix_stats_report index; the metric
+    # tables window over the metric_history union, so they are sorted in SQLite rather than read in index order.
+    partition = 'player_id, metric_id' if name_column else 'player_id'
+    source = metric_history(table, value_columns) if name_column else table
+
+    windowed = []
+    columns = []
+    for value in value_columns:
+        windowed += [
+            value,
+            f'LAG({value}) OVER history AS previous_{value}',
+            f'FIRST_VALUE({value}) OVER history AS first_{value}',
+        ]
+        columns += [
+            f'w.{value}',
+            f'COALESCE(w.{value} - w.previous_{value}, 0) AS delta_{value}',
+            f'COALESCE(w.{value} - w.first_{value}, 0) AS cumulative_{value}',
+        ]
+    windowed_list = ',\n            '.join(windowed)
+    column_list = ',\n        '.join(columns)
+
+    metric_columns = metric_join = order = ''
+    if name_column:
+        metric_columns = f'm.display_name AS {name_column},\n        m.wom_value,\n        m.excluded_from_efficiency,'
+        metric_join = f"JOIN metrics m\n    ON w.metric_id = m.id AND m.kind = '{table}'"
+        order = ', m.display_name'
+
+    return f'''
+    SELECT
+        p.rsn,
+        p.team,
+        {metric_columns}
+        {column_list},
+        {epoch('w.created_date')}
+    FROM (
+        SELECT
+            {partition},
+            {windowed_list},
+            created_date,
+            ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY created_date DESC, snapshot_date DESC, id DESC) AS newest
+        FROM {source}
+        WINDOW history AS (PARTITION BY {partition} ORDER BY created_date, snapshot_date, id)
+    ) w
+    JOIN players p
+    ON w.player_id = p.id
+    {metric_join}
+    WHERE w.newest = 1 {where}
+    ORDER BY p.team, p.rsn{order}
+    '''
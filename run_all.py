@@ -1,20 +1,39 @@
-import publish_stats
-import publish_bosses
-import publish_skills
-import publish_clues
-import publish_bingo_exp
+import report_engine
 import fetch_stats
 import fetch_roster
 import asyncio
+import os
+import db
+import job_queue
+from stage_scheduler import Stage, run_stages
+
+# Share of the fetch run that must be written before a first publish starts alongside the rest of the ingest;
+# 1 publishes only once ingest has finished.
+RUN_ALL_PUBLISH_WATERMARK = float(os.getenv('RUN_ALL_PUBLISH_WATERMARK', 0.9))
+# At most this many stages use each service at once.
+STAGE_LIMITS = {'wom': 1, 'sheets': 1}
+
+
+def ingest_watermark_reached() -> bool:
+    conn = db.connect_readonly()
+    progress = job_queue.run_progress(conn)
+    conn.close()
+    return progress >= RUN_ALL_PUBLISH_WATERMARK
+
 
 async def main() -> None:
-    await fetch_roster.main()
-    await fetch_stats.main()
-    publish_bosses.main()
-    publish_skills.main()
-    publish_clues.main()
-    publish_stats.main()
-    publish_bingo_exp.main()
+    stages = [
+        Stage('roster', fetch_roster.main, group='wom'),
+        Stage('stats', fetch_stats.main, after=['roster'], group='wom'),
+    ]
+    if RUN_ALL_PUBLISH_WATERMARK < 1:
+        # Reports read a consistent snapshot of the database while the remaining players are still fetched.
+        stages.append(Stage('early_reports', report_engine.main, after=['roster'],
+                            ready=('stats', ingest_watermark_reached), group='sheets', process=True))
+    stages.append(Stage('reports', report_engine.main, after=['stats'], group='sheets', process=True))
+
+    if not await run_stages(stages, STAGE_LIMITS):
+        raise SystemExit('run_all failed')
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,129 @@
+import publish_cache
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+
+SERVICE_ACCOUNT_FILE = 'solus-bingo-b27ae970a08f.json'
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+
+def col_num_to_letter(n):
+    string = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        string = chr(65 + remainder) + string
+    return string
+
+
+class PublishSession:
+    # Queues every structural change and value range, then sends them as one batchUpdate and one values.batchUpdate.
+    def __init__(self, spreadsheet_id: str) -> None:
+        self.spreadsheet_id = spreadsheet_id
+        credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+        # The discovery document bundled with google-api-python-client, so building the client makes no request.
+        service = build('sheets', 'v4', credentials=credentials, static_discovery=True, cache_discovery=False)
+        self.spreadsheets = service.spreadsheets()
+
+        metadata = self.spreadsheets.get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))'
+        ).execute()
+        self.sheets = {}
+        for sheet in metadata.get('sheets', []):
+            properties = sheet['properties']
+            grid = properties.get('gridProperties', {})
+            self.sheets[properties['title']] = {
+                'sheetId': properties['sheetId'],
+                'rows': grid.get('rowCount', 0),
+                'columns': grid.get('columnCount', 0),
+            }
+        # Choosing ids up front lets later requests in the same batch refer to sheets it adds.
+        self.next_sheet_id = max([sheet['sheetId'] for sheet in self.sheets.values()] + [0]) + 1
+
+        self.requests = []
+        self.data = []
+        self.caches = []
+
+    def ensure_sheet(self, title: str, rows: int, columns: int) -> bool:
+        sheet = self.sheets.get(title)
+        if sheet is None:
+            sheet = self.sheets[title] = {'sheetId': self.next_sheet_id, 'rows': rows, 'columns': columns}
+            self.next_sheet_id += 1
+            self.requests.append({'addSheet': {'properties': {
+                'sheetId': sheet['sheetId'],
+                'title': title,
+                'gridProperties': {'rowCount': rows, 'columnCount': columns},
+            }}})
+            return True
+
+        for dimension, key, size in [('ROWS', 'rows', rows), ('COLUMNS', 'columns', columns)]:
+            if size > sheet[key]:
+                self.requests.append({'appendDimension': {
+                    'sheetId': sheet['sheetId'], 'dimension': dimension, 'length': size - sheet[key]
+                }})
+                sheet[key] = size
+        return False
+
+    def grid_range(self, title: str, start_row: int = 0, end_row: int = None,
+                   start_column: int = 0, end_column: int = None) -> dict:
+        grid = {'sheetId': self.sheets[title]['sheetId'], 'startRowIndex': start_row, 'startColumnIndex': start_column}
+        if end_row is not None:
+            grid['endRowIndex'] = end_row
+        if end_column is not None:
+            grid['endColumnIndex'] = end_column
+        return grid
+
+    def set_column_width(self, title: str, columns: int, pixel_size: int) -> None:
+        self.requests.append({'updateDimensionProperties': {
+            'range': {'sheetId': self.sheets[title]['sheetId'], 'dimension': 'COLUMNS', 'startIndex': 0, 'endIndex': columns},
+            'properties': {'pixelSize': pixel_size},
+            'fields': 'pixelSize',
+        }})
+
+    def format_column(self, title: str, column: int, rows: int, number_format: dict) -> None:
+        self.requests.append({'repeatCell': {
+            'range': self.grid_range(title, 1, rows, column, column + 1),
+            'cell': {'userEnteredFormat': {'numberFormat': number_format}},
+            'fields': 'userEnteredFormat.numberFormat',
+        }})
+
+    def clear(self, title: str, start_row: int, end_row: int = None, start_column: int = 0, end_column: int = None) -> None:
+        sheet = self.sheets[title]
+        if start_row >= sheet['rows'] or start_column >= sheet['columns']:
+            return
+        self.requests.append({'updateCells': {
+            'range': self.grid_range(title, start_row, end_row, start_column, end_column),
+            'fields': 'userEnteredValue',
+        }})
+
+    def read(self, ranges: list) -> list:
+        # Every range in one values.batchGet; numbers come back as numbers.
+        response = self.spreadsheets.values().batchGet(
+            spreadsheetId=self.spreadsheet_id, ranges=ranges, valueRenderOption='UNFORMATTED_VALUE'
+        ).execute()
+        return [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+
+    def write(self, range_name: str, values: list) -> None:
+        self.data.append({'range': range_name, 'values': values})
+
+    def cache_rows(self, title: str, hashes: list) -> None:
+        self.caches.append((title, hashes))
+
+    def flush(self) -> int:
+        if self.requests:
+            self.spreadsheets.batchUpdate(spreadsheetId=self.spreadsheet_id, body={'requests': self.requests}).execute()
+        updated_cells = 0
+        if self.data:
+            response = self.spreadsheets.values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={'valueInputOption': 'RAW', 'data': self.data}
+            ).execute()
+            updated_cells = response.get('totalUpdatedCells', 0)
+
+        # Only once both calls succeeded do the cached rows describe what is on the sheet.
+        for title, hashes in self.caches:
+            publish_cache.save(self.spreadsheet_id, title, hashes)
+
+        self.requests = []
+        self.data = []
+        self.caches = []
+        return updated_cells
@@ -0,0 +1,51 @@
+import datetime
+import enum
+import hashlib
+import json
+import sqlite3
+import zlib
+import wom
+
+METRIC_ENUMS = {
+    'skills': wom.Skills,
+    'bosses': wom.Bosses,
+    'activities': wom.Activities,
+}
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return {_plain(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat(' ')
+    return value
+
+
+def encode_payload(player_detail: dict) -> tuple:
+    document = json.dumps(_plain(player_detail), sort_keys=True, separators=(',', ':')).encode()
+    digest = hashlib.sha256(document).hexdigest()
+    return digest, zlib.compress(document, 9)
+
+
+def decode_payload(payload: bytes) -> dict:
+    player_detail = json.loads(zlib.decompress(payload))
+    # build_rows expects the wom metric enums that to_dict() hands back.
+    for kind, metric_enum in METRIC_ENUMS.items():
+        for entry in player_detail['latest_snapshot']['data'][kind].values():
+            entry['metric'] = metric_enum(entry['metric'])
+    return player_detail
+
+
+def store(cursor: sqlite3.Cursor, entries: list) -> None:
+    cursor.executemany('''
+    INSERT OR IGNORE INTO snapshot_archive (hash, payload)
+    VALUES (?, ?)
+    ''', [(digest, payload) for _, _, digest, payload in entries])
+    cursor.executemany('''
+    INSERT OR IGNORE INTO snapshot_archive_index (player_id, snapshot_date, hash)
+    VALUES (?, ?, ?)
+    ''', [(player_id, snapshot_date, digest) for player_id, snapshot_date, digest, _ in entries])
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import metrics
+import snapshot_archive
+import wide_store
+from collections import ChainMap
+
+# full: every metric of every new snapshot, changes: only metrics whose value or eff moved since the player's last snapshot.
+SNAPSHOT_WRITE_MODE = os.getenv('SNAPSHOT_WRITE_MODE', 'full')
+
+COLUMNS = {
+    'skilling': ('player_id', 'metric_id', 'exp', 'ehp', 'rank', 'snapshot_date'),
+    'bossing': ('player_id', 'metric_id', 'kills', 'ehb', 'rank', 'snapshot_date'),
+    'clues': ('player_id', 'metric_id', 'clue_completions', 'rank', 'snapshot_date'),
+    'stats': ('player_id', 'ehb', 'ehp', 'snapshot_date'),
+}
+
+
+def insert_sql(table: str, columns) -> str:
+    placeholders = ', '.join('?' for _ in columns)
+    return f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({placeholders})'
+
+
+INSERTS = {table: insert_sql(table, columns) for table, columns in COLUMNS.items()}
+
+SNAPSHOT_UPSERT = '''
+INSERT INTO player_snapshots (player_id, snapshot_date)
+VALUES (?, ?)
+ON CONFLICT (player_id) DO UPDATE SET
+    snapshot_date = excluded.snapshot_date,
+    modified_date = CURRENT_TIMESTAMP
+'''
+
+MARKER_INSERT = '''
+INSERT OR IGNORE INTO snapshot_markers (player_id, snapshot_date)
+VALUES (?, ?)
+'''
+
+BASELINE_INSERT = '''
+INSERT OR IGNORE INTO baseline (player_id, metric_id, value, eff, rank, snapshot_date)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+LATEST_UPSERT = '''
+INSERT INTO latest (player_id, metric_id, value, eff, rank, snapshot_date)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (player_id, metric_id) DO UPDATE SET
+    previous_value = latest.value,
+    previous_eff = latest.eff,
+    value = excluded.value,
+    eff = excluded.eff,
+    rank = excluded.rank,
+    snapshot_date = excluded.snapshot_date,
+    created_date = CURRENT_TIMESTAMP
+WHERE excluded.snapshot_date > latest.snapshot_date
+'''
+
+
+def format_timestamp(value) -> str:
+    # Same text sqlite3's default datetime adapter produced for existing rows.
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(' ')
+    return value
+
+
+def snapshot_date_of(player_detail: dict) -> str:
+    return format_timestamp(player_detail['latest_snapshot']['created_at'])
+
+
+def build_rows(player_id: int, player_detail: dict, metric_cache: metrics.MetricCache) -> dict:
+    rows = {table: [] for table in INSERTS}
+    metric_id = metric_cache.metric_id
+
+    snapshot_date = snapshot_date_of(player_detail)
+    data = player_detail['latest_snapshot']['data']
+
+    for skill in data['skills'].values():
+        rows['skilling'].append((player_id, metric_id('skilling', skill['metric']), skill['experience'], skill['ehp'], skill['rank'], snapshot_date))
+
+    for boss in data['bosses'].values():
+        rows['bossing'].append((player_id, metric_id('bossing', boss['metric']), boss['kills'], boss['ehb'], boss['rank'], snapshot_date))
+
+    for activity in data['activities'].values():
+        metric = activity['metric']
+        if 'clue' in metric.value:
+            rows['clues'].append((player_id, metric_id('clues', metric), activity['score'], activity['rank'], snapshot_date))
+        if 'guardian' in metric.value:
+            rows['bossing'].append((player_id, metric_id('bossing', metric), activity['score'], 0.0, activity['rank'], snapshot_date))
+
+    player = player_detail['player']
+    rows['stats'].append((player_id, player['ehb'], player['ehp'], snapshot_date))
+
+    return rows
+
+
+def changed_rows(player_rows: dict, last_values: dict) -> dict:
+    # Drops metric rows whose (value, eff) match the cache, and records the new values; stats rows are always kept.
+    rows = {'stats': player_rows['stats']}
+    for table in ['skilling', 'bossing', 'clues']:
+        rows[table] = []
+        for row in player_rows[table]:
+            values = (row[2], row[3] if table != 'clues' else None)
+            if last_values.get(row[:2]) != values:
+                last_values[row[:2]] = values
+                rows[table].append(row)
+    return rows
+
+
+def state_rows(player_rows: dict):
+    # baseline/latest rows are (player_id, metric_id, value, eff, rank, snapshot_date).
+    yield from player_rows['skilling']
+    yield from player_rows['bossing']
+    for player_id, metric_id, clue_completions, rank, snapshot_date in player_rows['clues']:
+        yield player_id, metric_id, clue_completions, None, rank, snapshot_date
+
+
+class SnapshotWriter:
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = 50, on_flush=None) -> None:
+        self.conn = conn
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.rows = {table: [] for table in INSERTS}
+        self.snapshots = []
+        self.markers = []
+        self.archive = []
+        self.wide = []
+        self.state = []
+        self.player_ids = []
+        self.skipped = 0
+        self.rows_written = 0
+
+        cursor = conn.cursor()
+        cursor.execute('SELECT player_id, snapshot_date FROM player_snapshots')
+        self.last_seen = dict(cursor.fetchall())
+        self.layouts = wide_store.LayoutCache(conn)
+        self.metrics = metrics.MetricCache(conn)
+
+        self.last_values = {}
+        # What the buffered snapshots change, folded into last_seen and last_values once their flush commits.
+        self.pending_seen = {}
+        self.pending_values = {}
+        if SNAPSHOT_WRITE_MODE == 'changes':
+            # latest holds every player's newest values, which is what each new snapshot is compared against.
+            cursor.execute('SELECT player_id, metric_id, value, eff FROM latest')
+            self.last_values = {(player_id, metric_id): (value, eff) for player_id, metric_id, value, eff in cursor.fetchall()}
+
+    def add(self, player_id: int, player_detail: dict) -> bool:
+        snapshot_date = snapshot_date_of(player_detail)
+        changed = ChainMap(self.pending_seen, self.last_seen).get(player_id) != snapshot_date
+
+        if changed:
+            player_rows = build_rows(player_id, player_detail, self.metrics)
+            archived = snapshot_archive.encode_payload(player_detail)
+            if wide_store.writes_wide():
+                self.wide.append(wide_store.wide_entry(player_rows))
+            if wide_store.writes_long():
+                long_rows = player_rows
+                if SNAPSHOT_WRITE_MODE == 'changes':
+                    long_rows = changed_rows(player_rows, ChainMap(self.pending_values, self.last_values))
+                for table, rows in long_rows.items():
+                    self.rows[table].extend(rows)
+            self.state.extend(state_rows(player_rows))
+            self.snapshots.append((player_id, snapshot_date))
+            self.markers.append((player_id, snapshot_date))
+            self.archive.append((player_id, snapshot_date, *archived))
+            self.pending_seen[player_id] = snapshot_date
+        else:
+            self.skipped += 1
+        self.player_ids.append(player_id)
+
+        if len(self.player_ids) >= self.batch_size:
+            self.flush()
+
+        return changed
+
+    def flush(self) -> None:
+        if not self.player_ids:
+            return
+
+        with self.conn:
+            cursor = self.conn.cursor()
+            for table, rows in self.rows.items():
+                if rows:
+                    cursor.executemany(INSERTS[table], rows)
+                    self.rows_written += len(rows)
+            if self.wide:
+                wide_store.store(cursor, self.layouts, self.wide)
+                self.rows_written += len(self.wide)
+            cursor.executemany(BASELINE_INSERT, self.state)
+            cursor.executemany(LATEST_UPSERT, self.state)
+            cursor.executemany(SNAPSHOT_UPSERT, self.snapshots)
+            cursor.executemany(MARKER_INSERT, self.markers)
+            snapshot_archive.store(cursor, self.archive)
+            # Lets callers record progress in the same transaction as the rows themselves.
+            if self.on_flush is not None:
+                self.on_flush(cursor, self.player_ids)
+
+        self.last_seen.update(self.pending_seen)
+        self.last_values.update(self.pending_values)
+        self.pending_seen = {}
+        self.pending_values = {}
+        self.rows = {table: [] for table in INSERTS}
+        self.snapshots = []
+        self.markers = []
+        self.archive = []
+        self.wide = []
+        self.state = []
+        self.player_ids = []
@@ -0,0 +1,120 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+STAGE_POLL_SECONDS = 1.0
+
+
+class Stage:
+    # run: an async function, or a plain one run in a thread (or in a fresh process with process=True).
+    # after: stages that must finish first; the stage is skipped if one of them failed.
+    # ready: (stage name, check) also holds the stage back until check() is true or that stage has finished;
+    # when it finishes first, it counts as a dependency and a failure skips the stage.
+    # group: stages in a group share the group's concurrency limit.
+    def __init__(self, name: str, run, after: list = None, ready: tuple = None, group: str = None,
+                 process: bool = False) -> None:
+        self.name = name
+        self.run = run
+        self.after = after or []
+        self.ready = ready
+        self.group = group
+        self.process = process
+        self.released_by = None
+        self.released_at = 0.0
+        self.started = None
+        self.finished = None
+        self.error = None
+
+
+async def run_stages(stages: list, limits: dict) -> bool:
+    start = time.monotonic()
+    by_name = {stage.name: stage for stage in stages}
+    finished = {stage.name: asyncio.Event() for stage in stages}
+    semaphores = {group: asyncio.Semaphore(limit) for group, limit in limits.items()}
+    # spawn, so a stage that forks its own workers never starts from a copy of this threaded process.
+    processes = None
+    if any(stage.process for stage in stages):
+        processes = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+
+    async def release(stage: Stage) -> list:
+        # Returns the stages this one waited on to finish; a ready stage released by its watermark did not wait on it.
+        waited = list(stage.after)
+        for name in stage.after:
+            await finished[name].wait()
+            if by_name[name].finished >= stage.released_at:
+                stage.released_by, stage.released_at = name, by_name[name].finished
+        if stage.ready:
+            source, check = stage.ready
+            while not finished[source].is_set() and not check():
+                await asyncio.sleep(STAGE_POLL_SECONDS)
+            if not finished[source].is_set():
+                stage.released_by, stage.released_at = f'{source} watermark', time.monotonic() - start
+            else:
+                waited.append(source)
+                if by_name[source].finished >= stage.released_at:
+                    stage.released_by, stage.released_at = source, by_name[source].finished
+        return waited
+
+    async def execute(stage: Stage) -> None:
+        waited = await release(stage)
+        failed = [name for name in waited if by_name[name].error]
+        if failed:
+            stage.error = f'skipped, {", ".join(failed)} failed'
+            stage.started = stage.finished = time.monotonic() - start
+            finished[stage.name].set()
+            return
+
+        semaphore = semaphores.get(stage.group)
+        if semaphore is not None:
+            await semaphore.acquire()
+        stage.started = time.monotonic() - start
+        try:
+            if asyncio.iscoroutinefunction(stage.run):
+                await stage.run()
+            elif stage.process:
+                await asyncio.get_running_loop().run_in_executor(processes, stage.run)
+            else:
+                await asyncio.to_thread(stage.run)
+        except (Exception, SystemExit) as error:
+            stage.error = f'{type(error).__name__}: {error}'
+        finally:
+            stage.finished = time.monotonic() - start
+            if semaphore is not None:
+                semaphore.release()
+            finished[stage.name].set()
+
+    try:
+        await asyncio.gather(*(execute(stage) for stage in stages))
+    finally:
+        if processes is not None:
+            processes.shutdown()
+
+    print_timings(stages)
+    return not any(stage.error for stage in stages)
+
+
+def critical_path(stages: list) -> list:
+    # Back from the last stage to finish, through whatever released each stage.
+    by_name = {stage.name: stage for stage in stages}
+    stage = max(stages, key=lambda stage: stage.finished)
+    path = [stage.name]
+    while stage.released_by:
+        name = stage.released_by.removesuffix(' watermark')
+        path.append(stage.released_by)
+        stage = by_name[name]
+    return path[::-1]
+
+
+def print_timings(stages: list) -> None:
+    print(f'{"stage":<16}{"start":>9}{"end":>9}{"took":>9}  released by')
+    for stage in stages:
+        took = stage.finished - stage.started
+        released_by = stage.released_by or '-'
+        print(f'{stage.name:<16}{stage.started:>8.1f}s{stage.finished:>8.1f}s{took:>8.1f}s  {released_by}')
+        if stage.error:
+            print(f'    failed: {stage.error}')
+
+    path = critical_path(stages)
+    total = max(stage.finished for stage in stages)
+    print(f'critical path ({total:.1f}s): {" -> ".join(path)}')
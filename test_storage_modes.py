@@ -0,0 +1,124 @@
+import datetime
+import pytest
+import db
+import make_migrations
+import report_queries
+import snapshot_writer
+import wide_store
+
+wom = pytest.importorskip('wom')
+report_engine = pytest.importorskip('report_engine')
+
+PLAYERS = [('alice', 'red'), ('bob', 'blue'), ('carol', 'red')]
+SNAPSHOTS = 5
+
+
+def player_detail(player: int, snapshot: int) -> dict:
+    # Metrics move on different snapshots per player, and carol's newest snapshot changes nothing.
+    moves = snapshot if player != 3 else min(snapshot, SNAPSHOTS - 2)
+    skills = {
+        wom.Metric.Overall: (10000 + 150 * moves, 1.0 + 0.1 * moves),
+        wom.Metric.Attack: (5000, 0.5),
+        wom.Metric.Slayer: (5000 + 150 * moves * player, 0.5 + 0.1 * moves),
+    }
+    bosses = {
+        wom.Metric.Zulrah: (10 + (moves + player) // 2, 1.0 + 0.25 * ((moves + player) // 2)),
+        wom.Metric.TzTokJad: (3, 0.5),
+    }
+    activities = {
+        wom.Metric.ClueScrollsAll: 20 + moves // 3,
+        wom.Metric.GuardiansOfTheRift: 40 + moves * (player % 2),
+    }
+    return {
+        'player': {'ehb': 2.0 + 0.25 * moves, 'ehp': 1.0 + 0.1 * moves},
+        'latest_snapshot': {
+            'created_at': datetime.datetime(2024, 7, 1, 12) + datetime.timedelta(hours=snapshot),
+            'data': {
+                'skills': {
+                    metric.value: {'metric': metric, 'experience': exp, 'ehp': ehp, 'rank': 100}
+                    for metric, (exp, ehp) in skills.items()
+                },
+                'bosses': {
+                    metric.value: {'metric': metric, 'kills': kills, 'ehb': ehb, 'rank': 100}
+                    for metric, (kills, ehb) in bosses.items()
+                },
+                'activities': {
+                    metric.value: {'metric': metric, 'score': score, 'rank': 100}
+                    for metric, score in activities.items()
+                },
+            },
+        },
+    }
+
+
+def write_snapshots(tmp_path, monkeypatch, storage_engine: str, write_mode: str) -> None:
+    monkeypatch.setattr(db, 'DATABASE', str(tmp_path / f'{storage_engine}_{write_mode}.db'))
+    monkeypatch.setattr(wide_store, 'STORAGE_ENGINE', storage_engine)
+    monkeypatch.setattr(snapshot_writer, 'SNAPSHOT_WRITE_MODE', write_mode)
+    make_migrations.run()
+
+    conn = db.connect()
+    with conn:
+        conn.executemany('INSERT INTO players (rsn, team) VALUES (?, ?)', PLAYERS)
+    # Small batches, so several snapshots of one player land in the same flush and others span flushes.
+    writer = snapshot_writer.SnapshotWriter(conn, batch_size=4)
+    for snapshot in range(SNAPSHOTS):
+        for player in range(1, len(PLAYERS) + 1):
+            writer.add(player, player_detail(player, snapshot))
+    # A repeated snapshot is skipped rather than written twice.
+    assert not writer.add(1, player_detail(1, SNAPSHOTS - 1))
+    writer.flush()
+    conn.close()
+
+
+def published_reports(monkeypatch, source: str) -> dict:
+    monkeypatch.setattr(report_queries, 'REPORT_SOURCE', source)
+    reports = {}
+    for table in report_engine.SOURCES:
+        names = [name for name, report in report_engine.REPORTS.items() if report['source'] == table]
+        _, frames, failures = report_engine.compute_source(table, names, keep_source=False)
+        assert not failures
+        reports.update((name, report_engine.sheet_values(frame)) for name, frame in frames.items())
+    return reports
+
+
+def without_created_date(reports: dict) -> dict:
+    # created_date is the wall clock of the write, so it only matches within one database.
+    return {name: [row[:-1] for row in values] for name, values in reports.items()}
+
+
+STORAGE_MODES = [('long', 'full'), ('long', 'changes'), ('wide', 'full'), ('both', 'changes')]
+
+
+@pytest.mark.parametrize('storage_engine, write_mode', STORAGE_MODES)
+def test_report_sources_agree(tmp_path, monkeypatch, storage_engine, write_mode):
+    write_snapshots(tmp_path, monkeypatch, storage_engine, write_mode)
+
+    history = published_reports(monkeypatch, 'history')
+    assert published_reports(monkeypatch, 'window') == history
+    assert published_reports(monkeypatch, 'materialized') == history
+
+
+@pytest.mark.parametrize('storage_engine, write_mode', STORAGE_MODES[1:])
+def test_storage_modes_agree(tmp_path, monkeypatch, storage_engine, write_mode):
+    write_snapshots(tmp_path, monkeypatch, 'long', 'full')
+    expected = without_created_date(published_reports(monkeypatch, 'history'))
+
+    write_snapshots(tmp_path, monkeypatch, storage_engine, write_mode)
+    assert without_created_date(published_reports(monkeypatch, 'history')) == expected
+
+
+def test_changes_mode_stores_fewer_rows(tmp_path, monkeypatch):
+    counts = {}
+    for write_mode in ('full', 'changes'):
+        write_snapshots(tmp_path, monkeypatch, 'long', write_mode)
+        conn = db.connect()
+        counts[write_mode] = {
+            table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in ['skilling', 'bossing', 'clues', 'stats', 'snapshot_markers']
+        }
+        conn.close()
+
+    for table in ['skilling', 'bossing', 'clues']:
+        assert counts['changes'][table] < counts['full'][table]
+    assert counts['changes']['stats'] == counts['full']['stats'] == counts['full']['snapshot_markers']
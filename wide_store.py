@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from array import array
+import db
+import make_migrations
+import snapshot_writer
+
+# long: row per metric (default), wide: one packed row per player snapshot, both: write each.
+STORAGE_ENGINE = os.getenv('STORAGE_ENGINE', 'long')
+
+FIELDS = {
+    'skilling': ('exp', 'ehp', 'rank'),
+    'bossing': ('kills', 'ehb', 'rank'),
+    'clues': ('clue_completions', 'rank'),
+}
+
+BLOB_COLUMNS = {
+    'skilling': 'skills',
+    'bossing': 'bosses',
+    'clues': 'clues',
+}
+
+INTEGER_FIELDS = {'exp', 'kills', 'rank', 'clue_completions'}
+
+
+def writes_long() -> bool:
+    return STORAGE_ENGINE in ('long', 'both')
+
+
+def writes_wide() -> bool:
+    return STORAGE_ENGINE in ('wide', 'both')
+
+
+def insert_sql(with_created_date: bool = False) -> str:
+    columns = ['player_id', 'snapshot_date', 'layout_id', *BLOB_COLUMNS.values(), 'ehb', 'ehp']
+    if with_created_date:
+        columns.append('created_date')
+    placeholders = ', '.join('?' for _ in columns)
+    return f'INSERT OR IGNORE INTO wide_snapshots ({", ".join(columns)}) VALUES ({placeholders})'
+
+
+def pack(values) -> bytes:
+    packed = array('d', (math.nan if value is None else value for value in values))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(blob: bytes) -> array:
+    values = array('d')
+    values.frombytes(blob)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def wide_entry(player_rows: dict) -> tuple:
+    # Takes build_rows() output: every long row is (player_id, metric_id, *FIELDS, snapshot_date).
+    layout = {}
+    blobs = []
+    for table in FIELDS:
+        rows = player_rows[table]
+        layout[table] = [row[1] for row in rows]
+        blobs.append(pack(value for row in rows for value in row[2:-1]))
+
+    player_id, ehb, ehp, snapshot_date = player_rows['stats'][0]
+    return layout, (player_id, snapshot_date, *blobs, ehb, ehp)
+
+
+class LayoutCache:
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, layout FROM wide_layouts')
+        self.layouts = {layout_id: json.loads(layout) for layout_id, layout in cursor.fetchall()}
+        self.ids = {json.dumps(layout, sort_keys=True): layout_id for layout_id, layout in self.layouts.items()}
+
+    def layout_id(self, cursor: sqlite3.Cursor, layout: dict) -> int:
+        key = json.dumps(layout, sort_keys=True)
+        if key not in self.ids:
+            cursor.execute('INSERT INTO wide_layouts (layout) VALUES (?)', (key,))
+            self.ids[key] = cursor.lastrowid
+            self.layouts[cursor.lastrowid] = layout
+        return self.ids[key]
+
+
+def store(cursor: sqlite3.Cursor, layouts: LayoutCache, entries: list, with_created_date: bool = False) -> None:
+    rows = []
+    for layout, row in entries:
+        player_id, snapshot_date, *rest = row
+        rows.append((player_id, snapshot_date, layouts.layout_id(cursor, layout), *rest))
+    cursor.executemany(insert_sql(with_created_date), rows)
+
+
+def _value(field: str, value: float):
+    if math.isnan(value):
+        return None
+    if field in INTEGER_FIELDS:
+        return int(value)
+    return value
+
+
+# The snapshots the long-format adapter expands: each player's two newest, for the newest value and its delta, and
+# the first snapshot of each layout, which is where every metric first appears, for the change since the first.
+ADAPTER_SNAPSHOTS = '''
+SELECT player_id, snapshot_date, layout_id, {blob}, created_date
+FROM (
+    SELECT
+        player_id, snapshot_date, layout_id, {blob}, created_date,
+        ROW_NUMBER() OVER (PARTITION BY player_id ORDER BY created_date DESC, snapshot_date DESC) AS newest,
+        ROW_NUMBER() OVER (PARTITION BY player_id, layout_id ORDER BY created_date, snapshot_date) AS first_of_layout
+    FROM main.wide_snapshots
+)
+WHERE newest <= 2 OR first_of_layout = 1
+'''
+
+# stats needs no unpacking, so its whole history is served straight from the wide rows.
+STATS_VIEW = '''
+CREATE TEMP VIEW IF NOT EXISTS stats AS
+SELECT rowid AS id, player_id, ehb, ehp, NULL AS ehc, snapshot_date, created_date
+FROM main.wide_snapshots
+'''
+
+
+def long_rows(conn: sqlite3.Connection, table: str):
+    layouts = LayoutCache(conn)
+    fields = FIELDS[table]
+    width = len(fields)
+    cursor = conn.cursor()
+    cursor.execute(ADAPTER_SNAPSHOTS.format(blob=BLOB_COLUMNS[table]))
+    for player_id, snapshot_date, layout_id, blob, created_date in cursor:
+        values = unpack(blob)
+        for index, metric in enumerate(layouts.layouts[layout_id][table]):
+            chunk = values[index * width:(index + 1) * width]
+            yield (player_id, metric, *(_value(field, value) for field, value in zip(fields, chunk)), snapshot_date, created_date)
+
+
+def load_long_table(conn: sqlite3.Connection, table: str) -> None:
+    # A temp table or view shadows the main one, so the existing report queries run unchanged.
+    if table == 'stats':
+        conn.execute(STATS_VIEW)
+        return
+
+    columns = snapshot_writer.COLUMNS[table]
+    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table} AS SELECT * FROM main.{table} WHERE 0')
+    conn.execute(f'DELETE FROM temp.{table}')
+    conn.executemany(snapshot_writer.insert_sql(f'temp.{table}', columns + ('created_date',)), long_rows(conn, table))
+
+
+def main() -> None:
+    # Backfills wide_snapshots from the long tables, e.g. before switching STORAGE_ENGINE to wide.
+    make_migrations.run()
+
+    conn = db.connect()
+    cursor = conn.cursor()
+    start = time.monotonic()
+
+    snapshots = {}
+    for table, columns in snapshot_writer.COLUMNS.items():
+        cursor.execute(f'SELECT {", ".join(columns)}, created_date FROM {table} ORDER BY id')
+        for row in cursor.fetchall():
+            *row, created_date = row
+            if row[-1] is None:
+                continue
+            key = (row[0], row[-1])
+            snapshot = snapshots.setdefault(key, {'rows': {name: [] for name in snapshot_writer.COLUMNS}, 'created_date': created_date})
+            snapshot['rows'][table].append(tuple(row))
+            snapshot['created_date'] = min(snapshot['created_date'], created_date)
+
+    layouts = LayoutCache(conn)
+    entries = []
+    for (player_id, snapshot_date), snapshot in snapshots.items():
+        if not snapshot['rows']['stats']:
+            snapshot['rows']['stats'].append((player_id, None, None, snapshot_date))
+        layout, row = wide_entry(snapshot['rows'])
+        entries.append((layout, row + (snapshot['created_date'],)))
+
+    with conn:
+        store(conn.cursor(), layouts, entries, with_created_date=True)
+
+    conn.close()
+
+    print(f'packed {len(entries)} snapshots into wide rows in {time.monotonic() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
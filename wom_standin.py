@@ -0,0 +1,399 @@
+import argparse
+import collections
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Point the scripts at this server with WOM_API_BASE_URL=http://127.0.0.1:8765
+
+SKILLS = [
+    'overall', 'attack', 'defence', 'strength', 'hitpoints', 'ranged', 'prayer', 'magic',
+    'cooking', 'woodcutting', 'fletching', 'fishing', 'firemaking', 'crafting', 'smithing',
+    'mining', 'herblore', 'agility', 'thieving', 'slayer', 'farming', 'runecrafting',
+    'hunter', 'construction',
+]
+
+BOSSES = [
+    'abyssal_sire', 'alchemical_hydra', 'artio', 'barrows_chests', 'bryophyta', 'callisto',
+    'calvarion', 'cerberus', 'chambers_of_xeric', 'chambers_of_xeric_challenge_mode',
+    'chaos_elemental', 'chaos_fanatic', 'commander_zilyana', 'corporeal_beast',
+    'crazy_archaeologist', 'dagannoth_prime', 'dagannoth_rex', 'dagannoth_supreme',
+    'deranged_archaeologist', 'duke_sucellus', 'general_graardor', 'giant_mole',
+    'grotesque_guardians', 'hespori', 'kalphite_queen', 'king_black_dragon', 'kraken',
+    'kreearra', 'kril_tsutsaroth', 'lunar_chests', 'mimic', 'nex', 'nightmare',
+    'phosanis_nightmare', 'obor', 'phantom_muspah', 'sarachnis', 'scorpia', 'scurrius',
+    'skotizo', 'sol_heredit', 'spindel', 'tempoross', 'the_gauntlet',
+    'the_corrupted_gauntlet', 'the_leviathan', 'the_whisperer', 'theatre_of_blood',
+    'theatre_of_blood_hard_mode', 'thermonuclear_smoke_devil', 'tombs_of_amascut',
+    'tombs_of_amascut_expert', 'tzkal_zuk', 'tztok_jad', 'vardorvis', 'venenatis',
+    'vetion', 'vorkath', 'wintertodt', 'zalcano', 'zulrah',
+]
+
+ACTIVITIES = [
+    'league_points', 'bounty_hunter_hunter', 'bounty_hunter_rogue', 'clue_scrolls_all',
+    'clue_scrolls_beginner', 'clue_scrolls_easy', 'clue_scrolls_medium', 'clue_scrolls_hard',
+    'clue_scrolls_elite', 'clue_scrolls_master', 'last_man_standing', 'pvp_arena',
+    'soul_wars_zeal', 'guardians_of_the_rift',
+]
+
+TEAMS = ["Lil' Stinky Degens", "Ruken's Undertakers", 'Vegan Goblins: Second Harvest', 'Dark Templar']
+
+
+def timestamp(value: datetime.datetime) -> str:
+    return value.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class SyntheticWorld:
+    def __init__(self, competition_id: int, players: int, activity: float, seed: int) -> None:
+        self.competition_id = competition_id
+        self.activity = activity
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.snapshot_ids = 0
+        self.created = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=7)
+        self.players = {}
+        for index in range(1, players + 1):
+            name = f'Player {index:05d}'
+            self.players[name.lower()] = self.new_player(index, name)
+
+    def new_player(self, index: int, name: str) -> dict:
+        rng = self.random
+        skills = {}
+        for skill in SKILLS[1:]:
+            skills[skill] = {'experience': rng.randint(1_154, 13_034_431), 'rank': rng.randint(1, 2_000_000)}
+        overall = {
+            'experience': sum(skill['experience'] for skill in skills.values()),
+            'rank': rng.randint(1, 2_000_000),
+        }
+        skills = {'overall': overall, **skills}
+        bosses = {boss: {'kills': rng.choice([-1, 0, rng.randint(5, 3000)]), 'rank': rng.randint(-1, 500_000)} for boss in BOSSES}
+        activities = {activity: {'score': rng.choice([-1, rng.randint(1, 800)]), 'rank': rng.randint(-1, 500_000)} for activity in ACTIVITIES}
+        return {
+            'id': index,
+            'username': name.lower(),
+            'displayName': name,
+            'team': TEAMS[index % len(TEAMS)],
+            'skills': skills,
+            'bosses': bosses,
+            'activities': activities,
+            'updatedAt': self.created,
+            'lastChangedAt': self.created,
+            'snapshotId': 0,
+        }
+
+    def progress(self, player: dict, now: datetime.datetime) -> None:
+        rng = self.random
+        if rng.random() < self.activity:
+            for skill in self.random.sample(SKILLS[1:], 3):
+                gained = rng.randint(1_000, 250_000)
+                player['skills'][skill]['experience'] += gained
+                player['skills']['overall']['experience'] += gained
+            for boss in self.random.sample(BOSSES, 2):
+                player['bosses'][boss]['kills'] = max(player['bosses'][boss]['kills'], 0) + rng.randint(1, 20)
+            if rng.random() < 0.3:
+                for activity in ('clue_scrolls_all', rng.choice(ACTIVITIES[4:10])):
+                    player['activities'][activity]['score'] = max(player['activities'][activity]['score'], 0) + 1
+            player['lastChangedAt'] = now
+
+        self.snapshot_ids += 1
+        player['snapshotId'] = self.snapshot_ids
+        player['updatedAt'] = now
+
+    def update(self, username: str):
+        with self.lock:
+            player = self.players.get(username.lower())
+            if player is None:
+                return None
+            self.progress(player, datetime.datetime.now(datetime.timezone.utc))
+            return self.details(player)
+
+    def update_all(self) -> int:
+        with self.lock:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for player in self.players.values():
+                self.progress(player, now)
+            return len(self.players)
+
+    def player(self, player: dict) -> dict:
+        ehp = round(sum(skill['experience'] for skill in player['skills'].values()) / 2_000_000, 5)
+        ehb = round(sum(max(boss['kills'], 0) for boss in player['bosses'].values()) / 40, 5)
+        return {
+            'id': player['id'],
+            'username': player['username'],
+            'displayName': player['displayName'],
+            'type': 'regular',
+            'build': 'main',
+            'country': None,
+            'status': 'active',
+            'patron': False,
+            'exp': player['skills']['overall']['experience'],
+            'ehp': ehp,
+            'ehb': ehb,
+            'ttm': 0,
+            'tt200m': 0,
+            'registeredAt': timestamp(self.created),
+            'updatedAt': timestamp(player['updatedAt']),
+            'lastChangedAt': timestamp(player['lastChangedAt']),
+            'lastImportedAt': None,
+        }
+
+    def details(self, player: dict) -> dict:
+        base = self.player(player)
+        skills = {
+            skill: {
+                'metric': skill,
+                'experience': values['experience'],
+                'rank': values['rank'],
+                'level': 99 if skill != 'overall' else 2277,
+                'ehp': round(values['experience'] / 2_000_000, 5),
+            }
+            for skill, values in player['skills'].items()
+        }
+        bosses = {
+            boss: {'metric': boss, 'kills': values['kills'], 'rank': values['rank'], 'ehb': round(max(values['kills'], 0) / 40, 5)}
+            for boss, values in player['bosses'].items()
+        }
+        activities = {
+            activity: {'metric': activity, 'score': values['score'], 'rank': values['rank']}
+            for activity, values in player['activities'].items()
+        }
+        computed = {
+            'ehp': {'metric': 'ehp', 'value': base['ehp'], 'rank': player['id']},
+            'ehb': {'metric': 'ehb', 'value': base['ehb'], 'rank': player['id']},
+        }
+        return {
+            **base,
+            'combatLevel': 126,
+            'archive': None,
+            'latestSnapshot': {
+                'id': player['snapshotId'],
+                'playerId': player['id'],
+                'createdAt': base['updatedAt'],
+                'importedAt': None,
+                'data': {'skills': skills, 'bosses': bosses, 'activities': activities, 'computed': computed},
+            },
+        }
+
+    def competition(self) -> dict:
+        with self.lock:
+            created = timestamp(self.created)
+            participations = [
+                {
+                    'playerId': player['id'],
+                    'competitionId': self.competition_id,
+                    'teamName': player['team'],
+                    'createdAt': created,
+                    'updatedAt': created,
+                    'player': self.player(player),
+                    'progress': {'start': 0, 'end': 0, 'gained': 0},
+                    'levels': {'start': 0, 'end': 0, 'gained': 0},
+                }
+                for player in self.players.values()
+            ]
+        return {
+            'id': self.competition_id,
+            'title': 'Synthetic Bingo',
+            'metric': 'overall',
+            'type': 'team',
+            'startsAt': created,
+            'endsAt': timestamp(self.created + datetime.timedelta(days=14)),
+            'groupId': None,
+            'score': 0,
+            'visible': True,
+            'createdAt': created,
+            'updatedAt': created,
+            'participantCount': len(participations),
+            'group': None,
+            'participations': participations,
+        }
+
+
+class Faults:
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float, rate_limit: int, seed: int) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.window = collections.deque()
+        self.lock = threading.Lock()
+
+    def delay(self) -> None:
+        delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def retry_after(self):
+        if not self.rate_limit:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0] >= 60:
+                self.window.popleft()
+            if len(self.window) >= self.rate_limit:
+                return max(1, int(60 - (now - self.window[0])) + 1)
+            self.window.append(now)
+        return None
+
+    def fail(self) -> bool:
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+def fixture_path(directory: str, method: str, path: str) -> str:
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_')[:80]
+    digest = hashlib.sha1(f'{method} {path}'.lower().encode()).hexdigest()[:10]
+    return os.path.join(directory, f'{method.lower()}_{slug}_{digest}.json')
+
+
+def make_handler(world, faults, replay_dir, record_dir, upstream, counters):
+    class WomHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def reply(self, status: int, body, headers=None) -> None:
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def handle_request(self, method: str) -> None:
+            length = int(self.headers.get('Content-Length') or 0)
+            request_body = self.rfile.read(length) if length else None
+            path = self.path.split('?')[0].rstrip('/')
+            path = re.sub(r'^/v2', '', path)
+
+            if path == '/__stats':
+                self.reply(200, dict(counters))
+                return
+
+            counters[f'{method} requests'] += 1
+            faults.delay()
+
+            retry_after = faults.retry_after()
+            if retry_after is not None:
+                counters['429 responses'] += 1
+                self.reply(429, {'message': 'Too many requests.'}, {'Retry-After': str(retry_after)})
+                return
+            if faults.fail():
+                counters['injected errors'] += 1
+                self.reply(500, {'message': 'Injected failure.'})
+                return
+
+            if upstream:
+                status, body = self.proxy(method, request_body)
+            elif replay_dir:
+                status, body = self.replay(method)
+            else:
+                status, body = self.synthetic(method, path)
+            self.reply(status, body)
+
+        def proxy(self, method: str, request_body):
+            request = urllib.request.Request(upstream.rstrip('/') + self.path, data=request_body, method=method)
+            for name in ('x-api-key', 'User-Agent', 'Content-Type'):
+                if self.headers.get(name):
+                    request.add_header(name, self.headers[name])
+            try:
+                with urllib.request.urlopen(request) as response:
+                    status, body = response.status, json.loads(response.read() or b'null')
+            except urllib.error.HTTPError as error:
+                status, body = error.code, json.loads(error.read() or b'null')
+
+            if record_dir and status < 400:
+                os.makedirs(record_dir, exist_ok=True)
+                with open(fixture_path(record_dir, method, self.path), 'w') as fixture:
+                    json.dump({'status': status, 'body': body}, fixture)
+            return status, body
+
+        def replay(self, method: str):
+            try:
+                with open(fixture_path(replay_dir, method, self.path)) as fixture:
+                    recorded = json.load(fixture)
+            except FileNotFoundError:
+                counters['replay misses'] += 1
+                return 404, {'message': f'No recording for {method} {self.path}'}
+            return recorded['status'], recorded['body']
+
+        def synthetic(self, method: str, path: str):
+            match = re.fullmatch(r'/players/([^/]+)', path)
+            if match:
+                username = urllib.parse.unquote(match.group(1))
+                if method == 'POST':
+                    details = world.update(username)
+                else:
+                    with world.lock:
+                        player = world.players.get(username.lower())
+                        details = world.details(player) if player else None
+                if details is None:
+                    return 404, {'message': 'Player not found.'}
+                return 200, details
+
+            match = re.fullmatch(r'/competitions/(\d+)', path)
+            if match and method == 'GET' and int(match.group(1)) == world.competition_id:
+                return 200, world.competition()
+
+            match = re.fullmatch(r'/competitions/(\d+)/update-all', path)
+            if match and method == 'POST' and int(match.group(1)) == world.competition_id:
+                count = world.update_all()
+                return 200, {'message': f'{count} outdated (updated > 60 mins ago) players are being updated. This can take up to a few minutes.'}
+
+            return 404, {'message': 'Not found.'}
+
+        def do_GET(self) -> None:
+            self.handle_request('GET')
+
+        def do_POST(self) -> None:
+            self.handle_request('POST')
+
+    return WomHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local stand-in for the Wise Old Man API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--competition-id', type=int, default=49158)
+    parser.add_argument('--players', type=int, default=500, help='synthetic participants to generate')
+    parser.add_argument('--activity', type=float, default=0.3, help='chance a player gained anything between updates')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with a 500')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per minute before answering 429')
+    parser.add_argument('--replay', metavar='DIR', help='serve recorded responses from DIR')
+    parser.add_argument('--record', metavar='DIR', help='save upstream responses to DIR (needs --upstream)')
+    parser.add_argument('--upstream', metavar='URL', help='proxy to a real WOM API, e.g. https://api.wiseoldman.net/v2')
+    args = parser.parse_args()
+
+    world = SyntheticWorld(args.competition_id, args.players, args.activity, args.seed)
+    faults = Faults(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit, args.seed)
+    counters = collections.Counter()
+    handler = make_handler(world, faults, args.replay, args.record, args.upstream, counters)
+
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f'WOM stand-in listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(counters))
+
+
+if __name__ == '__main__':
+    main()